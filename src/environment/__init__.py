@@ -1,3 +1,4 @@
 from .base import FourRoomEnv, StateFields
 from .tagging import FourRoomEnvWithTagging
-from .pred_prey import ImposterTrainingGround
\ No newline at end of file
+from .pred_prey import ImposterTrainingGround
+from .vector import FourRoomVecEnv
@@ -6,6 +6,7 @@ from typing import Dict, List, Optional, Tuple
 import logging
 from gymnasium import Env, spaces
 from gymnasium.envs.registration import register
+from numba import njit
 
 from src.metrics import SusMetrics, EnvMetricHandler
 
@@ -59,24 +60,198 @@ class Action(Enum):
 
     @property
     def is_move_action(self):
-        return self in (Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT, Action.STAY)
+        return self in _MOVE_ACTIONS
 
     @property
     def is_job_action(self):
-        return self in (Action.KILL, Action.FIX, Action.SABOTAGE)
+        return self in _JOB_ACTIONS
+
+
+_MOVE_ACTIONS = frozenset({Action.STAY, Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT})
+_JOB_ACTIONS = frozenset({Action.KILL, Action.FIX, Action.SABOTAGE})
+
+
+# plain int action values for the hot paths (and the numba kernels, which can't branch on Enum members)
+# NOTE: only convert back to Action at the I/O boundary (e.g. compute_action)
+N_ACTIONS = len(Action)
+ACT_STAY = Action.STAY.value
+ACT_UP = Action.UP.value
+ACT_DOWN = Action.DOWN.value
+ACT_LEFT = Action.LEFT.value
+ACT_RIGHT = Action.RIGHT.value
+ACT_KILL = Action.KILL.value
+ACT_FIX = Action.FIX.value
+ACT_SABOTAGE = Action.SABOTAGE.value
+
+# (dx, dy) applied to an agent's position by each action, indexed by Action value
+ACTION_DELTAS = np.array(
+    [
+        [0, 0],  # ACT_STAY
+        [0, 1],  # ACT_UP
+        [0, -1],  # ACT_DOWN
+        [-1, 0],  # ACT_LEFT
+        [1, 0],  # ACT_RIGHT
+        [0, 0],  # ACT_KILL
+        [0, 0],  # ACT_FIX
+        [0, 0],  # ACT_SABOTAGE
+    ]
+)
+
+# display name of each action, indexed by Action value
+ACTION_NAMES = [str(Action(action)) for action in range(N_ACTIONS)]
+
+
+# (dx, dy) of each move action as plain ints, for scalar position updates
+MOVE_DELTAS = {
+    action: tuple(ACTION_DELTAS[action.value].tolist())
+    for action in Action
+    if action.is_move_action
+}
 
 
 def move(action, position):
-    if action == Action.UP:
-        return np.array([position[0], position[1] + 1])
-    elif action == Action.DOWN:
-        return np.array([position[0], position[1] - 1])
-    elif action == Action.LEFT:
-        return np.array([position[0] - 1, position[1]])
-    elif action == Action.RIGHT:
-        return np.array([position[0] + 1, position[1]])
-    else:
-        return position
+    dx, dy = MOVE_DELTAS.get(action, (0, 0))
+    return int(position[0]) + dx, int(position[1]) + dy
+
+
+def build_move_table(grid):
+    """
+    Precomputes the cell an agent ends up in for every (cell, action) pair.
+
+    Cells are numbered `y * n_cols + x`. Moves that would leave the grid or land on a wall, as well as
+    non-move actions, keep the agent in its cell.
+
+    Parameters:
+    - grid (np.ndarray): Boolean grid, False where there is a wall. Checked as `grid[y, x]`.
+
+    Returns:
+    - np.ndarray: (n_cells, len(Action)) uint8 array of target cells, indexed by cell and Action value.
+    """
+    n_rows, n_cols = grid.shape
+    assert n_rows * n_cols <= 256, "cell ids must fit in a uint8"
+
+    cells = np.arange(n_rows * n_cols)
+    cell_xy = np.column_stack((cells % n_cols, cells // n_cols))
+    targets = cell_xy[:, None, :] + ACTION_DELTAS[None, :, :]
+    in_bounds = np.all((targets >= 0) & (targets < [n_cols, n_rows]), axis=-1)
+
+    target_cells = np.where(in_bounds, targets[..., 1] * n_cols + targets[..., 0], cells[:, None])
+    valid_moves = in_bounds & grid.reshape(-1)[target_cells]
+    return np.where(valid_moves, target_cells, cells[:, None]).astype(np.uint8)
+
+
+@njit(cache=True)
+def agents_step_kernel(
+    agent_action_order,
+    resolved_actions,
+    move_table,
+    agent_cells,
+    cell_occupancy,
+    alive_agents,
+    imposter_mask,
+    job_at_cell,
+    completed_jobs,
+    used_tag_actions,
+    tag_counts,
+    agent_rewards,
+    victim_draws,
+    kill_reward,
+    complete_job_reward,
+    sabotage_reward,
+    action_targets,
+):
+    """
+    Applies every agent's action, one agent at a time in `agent_action_order`, updating the state arrays in place.
+
+    Positions are cell ids (see `build_move_table`) and `job_at_cell` maps each cell to the index of its job (-1 if none). Moves follow `move_table`, kills remove a random alive crew member
+    at the killer's position, fixes complete and sabotages undo the job at the agent's position and tag actions
+    (values >= len(Action)) tag the agent `action - len(Action)`. Dead agents can't move, kill, fix or sabotage.
+
+    Parameters:
+    - cell_occupancy (np.ndarray): Per-cell int64 bitmask of the agents in that cell (bit `agent_idx`), updated on moves.
+    - victim_draws (np.ndarray): One uniform [0, 1) draw per agent, used to pick a victim when several crew members share a cell.
+    - action_targets (np.ndarray): Output, the agent killed, job fixed/sabotaged or agent tagged by each agent. -1 if the action had no effect.
+
+    Returns:
+    - tuple containing the number of kills, completed jobs and sabotaged jobs during the step.
+    """
+    n_kills = n_fixes = n_sabotages = 0
+
+    # bitmask of the alive crew members, matches the cell_occupancy bits
+    alive_crew_bits = 0
+    for agent_idx in range(alive_agents.shape[0]):
+        if alive_agents[agent_idx] and not imposter_mask[agent_idx]:
+            alive_crew_bits |= 1 << agent_idx
+
+    for agent_idx in agent_action_order:
+        action = resolved_actions[agent_idx]
+        action_targets[agent_idx] = -1
+
+        # tag action (NOTE: tags count even if the tagging agent is dead)
+        if action >= N_ACTIONS:
+            tagged = action - N_ACTIONS
+            if not used_tag_actions[agent_idx] and alive_agents[tagged]:
+                tag_counts[tagged] += 1
+                used_tag_actions[agent_idx] = True
+                action_targets[agent_idx] = tagged
+            continue
+
+        if not alive_agents[agent_idx]:  # agent is dead
+            continue
+
+        cell = agent_cells[agent_idx]
+
+        # agent attempts kill action
+        if action == ACT_KILL:
+            # who else is at this position
+            victims = cell_occupancy[cell] & alive_crew_bits
+            n_at_pos = 0
+            remaining = victims
+            while remaining:
+                remaining &= remaining - 1  # clear lowest set bit
+                n_at_pos += 1
+
+            if n_at_pos > 0:
+                # choosing random victim, the `victim_rank`-th lowest agent index at this position
+                victim_rank = int(victim_draws[agent_idx] * n_at_pos)
+                for _ in range(victim_rank):
+                    victims &= victims - 1
+                victim_idx = 0
+                while not (victims >> victim_idx) & 1:
+                    victim_idx += 1
+
+                alive_crew_bits &= ~(1 << victim_idx)
+                alive_agents[victim_idx] = False
+                agent_rewards[victim_idx] = kill_reward
+                agent_rewards[agent_idx] = kill_reward
+                action_targets[agent_idx] = victim_idx
+                n_kills += 1
+
+        # agent attempts to fix or sabotage the job at its position
+        elif action == ACT_FIX or action == ACT_SABOTAGE:
+            job_idx = job_at_cell[cell]
+            if job_idx < 0:  # no job at this position
+                pass
+            elif action == ACT_FIX and not completed_jobs[job_idx]:
+                completed_jobs[job_idx] = True
+                agent_rewards[agent_idx] = complete_job_reward
+                action_targets[agent_idx] = job_idx
+                n_fixes += 1
+            elif action == ACT_SABOTAGE and completed_jobs[job_idx]:
+                completed_jobs[job_idx] = False
+                agent_rewards[agent_idx] = -1 * sabotage_reward
+                action_targets[agent_idx] = job_idx
+                n_sabotages += 1
+
+        # remaining actions are all moves
+        else:
+            target_cell = move_table[cell, action]
+            if target_cell != cell:
+                cell_occupancy[cell] &= ~(1 << agent_idx)
+                cell_occupancy[target_cell] |= 1 << agent_idx
+                agent_cells[agent_idx] = target_cell
+
+    return n_kills, n_fixes, n_sabotages
 
 
 CREW_ACTIONS = [
@@ -122,8 +297,7 @@ class FourRoomEnv(Env):
 
         self._validate_init_args(n_imposters, n_crew, n_jobs)
 
-        if random_state is not None:
-            np.random.seed(random_state)
+        self._rng = np.random.default_rng(random_state)
 
         self.logger = configure_logging(debug=debug)
 
@@ -144,6 +318,8 @@ class FourRoomEnv(Env):
         self.n_imposters = n_imposters
         self.n_crew = n_crew
         self.n_agents = n_imposters + n_crew
+        self._agent_idxs = np.arange(self.n_agents)
+        assert self.n_agents < 64, "cell occupancy bitmasks hold at most 63 agents"
         self.n_jobs = n_jobs
         self.kill_reward = kill_reward
         self.complete_job_reward = complete_job_reward
@@ -155,8 +331,9 @@ class FourRoomEnv(Env):
         self.max_time_steps = max_time_steps
         self.t = None
 
-        self.job_positions = None
-        self.agent_positions = None
+        # positions are stored as cell ids (y * n_cols + x), see the agent_positions/job_positions properties
+        self.job_cells = None
+        self.agent_cells = None
         self.alive_agents = None
         self.completed_jobs = None
 
@@ -196,8 +373,6 @@ class FourRoomEnv(Env):
         if len(self.walls) != 0:
             self.grid[self.walls[:, 0], self.walls[:, 1]] = 0
 
-        self.valid_positions = np.argwhere(self.grid)
-
         self.imposter_actions = IMPOSTER_ACTIONS
         self.crew_actions = CREW_ACTIONS
         self.n_imposter_actions = len(IMPOSTER_ACTIONS)
@@ -206,9 +381,20 @@ class FourRoomEnv(Env):
         self.n_rows = 9
         self.n_cols = 9
 
+        cells = np.arange(self.n_rows * self.n_cols)
+        self._cell_to_xy = np.column_stack((cells % self.n_cols, cells // self.n_cols))
+        # NOTE: grid is built as grid[x, y], its transpose is laid out by cell id
+        self.valid_cells = np.flatnonzero(self.grid.T.reshape(-1)).astype(np.uint8)
+        self.valid_positions = self._cell_to_xy[self.valid_cells]
+        self._move_table = build_move_table(self.grid)
+        # a flat list is much cheaper than an ndarray to index one cell at a time
+        self._valid_cell = self.grid.reshape(-1).tolist()
+
         self.action_space = spaces.Discrete(len(Action))
+        self._action_n = self.action_space.n
 
-        self.observation_space = spaces.Tuple(
+        # fields of the state tuple, observations are these fields flattened into one Box (see _build_flat_layout)
+        self.state_space = spaces.Tuple(
             (
                 spaces.Box(
                     low=0, high=self.n_rows, shape=(self.n_agents, 2), dtype=int
@@ -227,18 +413,114 @@ class FourRoomEnv(Env):
             )
         )
 
+        self._build_flat_layout()
+
+    @property
+    def agent_positions(self):
+        return self._cell_to_xy[self.agent_cells]
+
+    @agent_positions.setter
+    def agent_positions(self, positions):
+        self._set_agent_cells(self._xy_to_cell(positions))
+
+    def _set_agent_cells(self, agent_cells):
+        self.agent_cells = agent_cells
+        # cell -> bitmask of the agents in it (bit agent_idx), kept up to date by the step kernel
+        self._cell_occupancy = np.zeros(self.n_rows * self.n_cols, dtype=np.int64)
+        np.bitwise_or.at(self._cell_occupancy, agent_cells, 1 << self._agent_idxs)
+
     @property
-    def flattened_state_size(self):
-        return spaces.flatten_space(self.observation_space).shape[0]
+    def job_positions(self):
+        return self._cell_to_xy[self.job_cells]
+
+    @job_positions.setter
+    def job_positions(self, positions):
+        self._set_job_cells(self._xy_to_cell(positions))
+
+    def _set_job_cells(self, job_cells):
+        self.job_cells = job_cells
+        # cell -> job index lookup, -1 where there is no job
+        self._job_at_cell = np.full(self.n_rows * self.n_cols, -1, dtype=np.int16)
+        self._job_at_cell[job_cells] = np.arange(len(job_cells))
 
-    def flatten_state(self, state):
-        return spaces.flatten(self.observation_space, state)
+    def _xy_to_cell(self, positions):
+        positions = np.asarray(positions)
+        return (positions[..., 1] * self.n_cols + positions[..., 0]).astype(np.uint8)
+
+    def _build_flat_layout(self):
+        """
+        Precomputes where each field of the state lives in the flattened observation and builds the
+        flat `self.observation_space` Box.
+
+        Must be called again whenever `self.state_space` is redefined (e.g. by subclasses).
+        """
+        self._flat_layout = []
+        lows, highs = [], []
+        offset = 0
+        for field_space in self.state_space:
+            field_size = int(np.prod(field_space.shape))
+            self._flat_layout.append(
+                (slice(offset, offset + field_size), field_space.shape, field_space.dtype)
+            )
+            if isinstance(field_space, spaces.MultiBinary):
+                lows.append(np.zeros(field_size))
+                highs.append(np.ones(field_size))
+            else:
+                lows.append(np.broadcast_to(field_space.low, field_space.shape).ravel())
+                highs.append(np.broadcast_to(field_space.high, field_space.shape).ravel())
+            offset += field_size
+        self._flat_size = offset
+        self.flattened_state_size = self._flat_size
+
+        # every field is a small non-negative int or flag, observations use the narrowest unsigned type that fits them
+        # NOTE: the tuple view (see to_tuple) keeps the field dtypes, so arithmetic on positions can't wrap around
+        low, high = np.concatenate(lows), np.concatenate(highs)
+        assert np.all(low >= 0), "observation encoding assumes non-negative fields"
+        obs_dtype = np.min_scalar_type(int(high.max(initial=1)))
+        self.observation_space = spaces.Box(
+            low=low.astype(obs_dtype), high=high.astype(obs_dtype), dtype=obs_dtype
+        )
+        # reset and step write their observation here, it is overwritten by the next call
+        self._obs_buf = np.empty(self._flat_size, dtype=obs_dtype)
+
+    def flatten_state(self, state, out=None):
+        # observations are already flat
+        if not isinstance(state, tuple):
+            return np.asarray(state)
+
+        # NOTE: writes each field straight into its precomputed slice, skipping gymnasium's per-subspace dispatch
+        flat_state = (
+            np.empty(self._flat_size, dtype=self.observation_space.dtype)
+            if out is None
+            else out
+        )
+        for (field_slice, _, _), field in zip(self._flat_layout, state):
+            flat_state[field_slice] = np.ravel(field)
+        return flat_state
 
     def unflatten_state(self, state):
         # if tensor, convert to numpy array
-        if isinstance(state, torch.Tensor):
-            state = state.numpy()
-        return spaces.unflatten(self.observation_space, state)
+        state = state.numpy() if hasattr(state, "numpy") else state
+        return tuple(
+            state[field_slice].reshape(shape).astype(dtype, copy=False)
+            for field_slice, shape, dtype in self._flat_layout
+        )
+
+    def to_tuple(self, obs):
+        """
+        Splits a flat observation back into the state tuple, indexed by `self.state_fields`.
+        """
+        return self.unflatten_state(obs)
+
+    def _get_state(self) -> Tuple:
+        return (
+            self.agent_positions,
+            self.alive_agents,
+            *([self.job_positions, self.completed_jobs] if self.n_jobs > 0 else []),
+        )
+
+    def _get_obs(self) -> np.ndarray:
+        return self.flatten_state(self._get_state(), out=self._obs_buf)
 
     def _validate_init_args(self, n_imposters, n_crew, n_jobs):
         assert n_imposters > 0, f"Must have at least one imposter. Got {n_imposters}."
@@ -248,7 +530,7 @@ class FourRoomEnv(Env):
             n_imposters < n_crew
         ), f"Must be more crew members than imposters. Got {n_imposters} imposters and {n_crew} crew members."
 
-    def reset(self, seed: Optional[int] = None, **kwargs) -> Tuple[Tuple, Dict]:
+    def reset(self, seed: Optional[int] = None, **kwargs) -> Tuple[np.ndarray, Dict]:
         """
         Reset the environment to the initial state
 
@@ -261,18 +543,19 @@ class FourRoomEnv(Env):
         Args:
         - seed (int): An optional seed to use for the random number generator.
         Returns:
-        Tuple: A tuple containing the initial state and an empty dictionary
+        Tuple: A tuple containing the initial flat observation (see `to_tuple`) and the episode metrics
         """
         if seed is not None:
-            np.random.seed(seed)
+            self._rng = np.random.default_rng(seed)
 
         # reset metrics
         self.metrics.reset()
+        self._reset_metric_counters()
 
         # determining imposter positions
         if self.shuffle_imposter_index:
-            self.imposter_idxs = np.random.choice(
-                range(self.n_agents), size=self.n_imposters, replace=False
+            self.imposter_idxs = self._rng.choice(
+                self.n_agents, size=self.n_imposters, replace=False
             )
         else:
             self.imposter_idxs = np.arange(self.n_imposters)
@@ -280,26 +563,35 @@ class FourRoomEnv(Env):
         self.imposter_mask = np.zeros(self.n_agents, dtype=bool)
         self.imposter_mask[self.imposter_idxs] = True
         self.crew_mask = ~self.imposter_mask
-        self.crew_idxs = np.where(self.crew_mask)[0]
+        self.crew_idxs = np.flatnonzero(self.crew_mask)
+
+        # no tag actions in this environment, the step kernel still needs somewhere to write tags to
+        self._no_used_tag_actions = np.zeros(self.n_agents, dtype=bool)
+        self._no_tag_counts = np.zeros(self.n_agents, dtype=int)
+        self._action_targets = np.full(self.n_agents, -1, dtype=int)
+        # reused by every step, step() returns it so callers must copy rewards they keep across steps
+        self._agent_rewards_buf = np.zeros(self.n_agents)
+        # scratch space for the per-step boolean masks over agents
+        self._agent_mask_scratch = np.empty(self.n_agents, dtype=bool)
+        # agent action order, shuffled in place by step when is_action_order_random
+        self._action_order_buf = np.arange(self.n_agents)
 
         # Select agent and job positions randomly from the valid positions
 
         # random agent positions
-        agent_cells = np.random.choice(
-            len(self.valid_positions), size=self.n_agents, replace=True
+        self._set_agent_cells(
+            self._rng.choice(self.valid_cells, size=self.n_agents, replace=True)
         )
-        self.agent_positions = self.valid_positions[agent_cells]
 
         # random job positions
         # NOTE: any two jobs can't be at the same position
-        job_cells = np.random.choice(
-            len(self.valid_positions), size=self.n_jobs, replace=False
+        self._set_job_cells(
+            self._rng.choice(self.valid_cells, size=self.n_jobs, replace=False)
         )
 
-        self.job_positions = self.valid_positions[job_cells]
-
         self.alive_agents = np.ones(self.n_agents, dtype=bool)
         self.completed_jobs = np.zeros(self.n_jobs, dtype=bool)
+        self._reset_counters()
 
         # Agent Action Map: keeps tracks of actions available to each agent
         # when agent_step is called, this list is indexed to get the action
@@ -311,23 +603,78 @@ class FourRoomEnv(Env):
         for imposter_idx in self.imposter_idxs:
             self.agent_action_map[imposter_idx] = self.imposter_actions.copy()
 
+        self._build_action_lut()
+
         # initializing timestep
         self.t = 0
 
-        return (
-            (
-                self.agent_positions,
-                self.alive_agents,
-                *([self.job_positions, self.completed_jobs] if self.n_jobs > 0 else []),
-            ),
-            self.metrics.get_metrics(),
+        return self._get_obs(), self.get_metrics()
+
+    def _reset_metric_counters(self):
+        # per-step metrics are counted in plain ints and only flushed into `self.metrics` by get_metrics
+        self._ctr_total_steps = 0
+        self._ctr_killed_crew = 0
+        self._ctr_completed_jobs = 0
+        self._ctr_sabotaged_jobs = 0
+        self._ctr_imp_voted_out = 0
+        self._ctr_crew_voted_out = 0
+
+    def _flush_metric_counters(self):
+        self.metrics.update(SusMetrics.TOTAL_TIME_STEPS, self._ctr_total_steps)
+        self.metrics.update(SusMetrics.IMP_KILLED_CREW, self._ctr_killed_crew)
+        self.metrics.update(SusMetrics.COMPLETED_JOBS, self._ctr_completed_jobs)
+        self.metrics.update(SusMetrics.SABOTAGED_JOBS, self._ctr_sabotaged_jobs)
+        self.metrics.update(SusMetrics.IMP_VOTED_OUT, self._ctr_imp_voted_out)
+        self.metrics.update(SusMetrics.CREW_VOTED_OUT, self._ctr_crew_voted_out)
+
+    def get_metrics(self) -> Dict[SusMetrics, int]:
+        """
+        Returns the metrics of the current episode.
+        """
+        self._flush_metric_counters()
+        return self.metrics.get_metrics()
+
+    def _reset_counters(self):
+        """
+        Recomputes the alive agent and completed job counters used by the win conditions from the state arrays.
+
+        Must be called again whenever `self.alive_agents` or `self.completed_jobs` are modified outside of `step`.
+        """
+        self._n_alive_imposters = int(np.sum(self.alive_agents[self.imposter_mask]))
+        self._n_alive_crew = int(np.sum(self.alive_agents)) - self._n_alive_imposters
+        self._n_completed_jobs = int(np.sum(self.completed_jobs))
+
+    def _build_action_lut(self):
+        """
+        Builds `self.agent_action_lut`, an integer version of `self.agent_action_map`.
+
+        Row `agent_idx` holds the Action value of each of the agent's actions. Tag actions (integers in the map)
+        are stored as `len(Action) + tagged_agent_idx`. Rows are padded with -1 past the agent's last action.
+
+        Also records the number of actions of each agent in `self._n_actions_per_agent`, used by `sample_actions`.
+
+        Must be called again whenever `self.agent_action_map` is modified.
+        """
+        self._n_actions_per_agent = np.array(
+            [len(self.agent_action_map[agent_idx]) for agent_idx in range(self.n_agents)]
         )
+        n_actions = self._n_actions_per_agent.max()
+        self.agent_action_lut = np.full((self.n_agents, n_actions), -1, dtype=np.int8)
+        for agent_idx, actions in self.agent_action_map.items():
+            self.agent_action_lut[agent_idx, : len(actions)] = [
+                action.value if isinstance(action, Action) else N_ACTIONS + action
+                for action in actions
+            ]
 
     def sample_actions(self):
-        actions = np.zeros(self.n_agents, dtype=int)
-        for agent_idx in self.agent_action_map:
-            actions[agent_idx] = np.random.choice(len(self.agent_action_map[agent_idx]))
-        return actions
+        return self._rng.integers(0, self._n_actions_per_agent)
+
+    def spawn_rng(self) -> np.random.Generator:
+        """
+        Returns an independent generator derived from the env's seed, for callers that need their own random
+        stream (e.g. eps-greedy draws in training) without consuming the env's draws.
+        """
+        return self._rng.spawn(1)[0]
 
     def step(self, agent_actions):
         """
@@ -343,7 +690,7 @@ class FourRoomEnv(Env):
 
         Returns:
         - tuple containing:
-            - A tuple of (agent_positions, job_positions, completed_jobs, alive_agents) reflecting the new state of the environment.
+            - The flat observation of (agent_positions, alive_agents, job_positions, completed_jobs) reflecting the new state of the environment (see `to_tuple`).
             - agent_rewards (numpy.ndarray): An array of rewards received by each agent during this step.
             - done (bool): A flag indicating whether the game has reached a terminal state.
             - truncated (bool): A flag indicating whether the episode was truncated (not applicable in this context, but included for API consistency).
@@ -358,36 +705,37 @@ class FourRoomEnv(Env):
             len(agent_actions) == self.n_agents
         ), f"Expected {self.n_agents} actions, got {len(agent_actions)}"
         assert all(
-            action < self.action_space.n for action in agent_actions
+            action < self._action_n for action in agent_actions
         ), f"Invalid action(s) {agent_actions}"
 
         truncated = False
         done = False
-        self.metrics.increment(SusMetrics.TOTAL_TIME_STEPS, 1)
+        self._ctr_total_steps += 1
 
         # initialize the agent reward array before computing all agent rewards
-        self.agent_rewards = np.zeros(self.n_agents)
+        self._agent_rewards_buf.fill(0)
+        self.agent_rewards = self._agent_rewards_buf
 
         # getting the order in which agent actions will be performed
-        agent_action_order = list(range(self.n_agents))
+        agent_action_order = self._action_order_buf
         if self.is_action_order_random:
-            np.random.shuffle(agent_action_order)
+            self._rng.shuffle(agent_action_order)
 
         # perform action for each agent
-        for agent_idx in agent_action_order:
-
-            self._agent_step(
-                agent_idx=agent_idx,
-                agent_action=self.agent_action_map[agent_idx][agent_actions[agent_idx]],
-            )
+        self._agents_step(
+            agent_actions,
+            agent_action_order,
+            used_tag_actions=self._no_used_tag_actions,
+            tag_counts=self._no_tag_counts,
+        )
 
         team_win, team_reward = self.check_win_condition()
         done = done or team_win
 
         self.agent_rewards = self._merge_rewards(self.agent_rewards, team_reward)
 
-        zero_rewards = self.agent_rewards == 0
-        self.agent_rewards[zero_rewards] = self.time_step_reward
+        zero_rewards = np.equal(self.agent_rewards, 0, out=self._agent_mask_scratch)
+        np.putmask(self.agent_rewards, zero_rewards, self.time_step_reward)
 
         if self.t == self.max_time_steps - 1:
             truncated = True
@@ -395,15 +743,11 @@ class FourRoomEnv(Env):
             self.t += 1
 
         return (
-            (
-                self.agent_positions,
-                self.alive_agents,
-                *([self.job_positions, self.completed_jobs] if self.n_jobs > 0 else []),
-            ),
+            self._get_obs(),
             self.agent_rewards,
             done,
             truncated,
-            self.metrics.get_metrics(),
+            self.get_metrics(),
         )
 
     def check_win_condition(self):
@@ -425,32 +769,26 @@ class FourRoomEnv(Env):
         # TODO: Check if all jobs are completed
         done = False
         reward = 0
-        if (
-            np.sum(self.alive_agents[self.imposter_mask]) == 0
-            or np.sum(self.completed_jobs) == self.n_jobs
-        ):
+        if self._n_alive_imposters == 0 or self._n_completed_jobs == self.n_jobs:
             self.logger.debug("CREW won!")
             self.metrics.update(SusMetrics.CREW_WON, 1)
             done = True
             reward = self.game_end_reward
 
         # check more or = imposters than crew (imposters won)
-        elif (
-            self.alive_agents.sum()
-            - self.alive_agents[self.imposter_mask].sum()  # crew memebrs
-            <= self.alive_agents[self.imposter_mask].sum()  # imposters
-        ):
+        elif self._n_alive_crew <= self._n_alive_imposters:
             self.logger.debug("IMPOSTERS won!")
             self.metrics.update(SusMetrics.IMPOSTER_WON, 1)
             done = True
             reward = -1 * self.game_end_reward
 
-        if done:
+        if done and self.logger.isEnabledFor(logging.DEBUG):
+            self._flush_metric_counters()
             self.logger.debug(
                 f"""
 GAME OVER!
-    Alive Crew: {np.argwhere(self.alive_agents & ~self.imposter_mask).flatten()}
-    Alive Imposters: {np.argwhere(self.alive_agents & self.imposter_mask).flatten()}
+    Alive Crew: {np.flatnonzero(self.alive_agents & self.crew_mask)}
+    Alive Imposters: {np.flatnonzero(self.alive_agents & self.imposter_mask)}
     Completed Jobs: {list(map(tuple, self.job_positions[self.completed_jobs]))}
 Metrics:
 {str(self.metrics)}
@@ -459,96 +797,92 @@ Metrics:
 
         return done, reward
 
-    def _agent_step(self, agent_idx, agent_action) -> None:
+    def _agents_step(self, agent_actions, agent_action_order, used_tag_actions, tag_counts) -> None:
         """
-        Processes a single step for an agent by executing the specified action within the environment.
+        Processes a single step for every agent by executing the specified actions within the environment.
 
-        This method handles the movement, killing, fixing, and sabotaging actions of an agent.
+        This method handles the movement, killing, fixing, sabotaging and tagging actions of the agents.
         Movement is allowed based on the room map, killing removes another agent at the same position,
         fixing completes a job at the agent's position, and sabotaging undoes a completed job at the agent's position.
         Rewards or penalties are assigned to agents based on their actions.
+        The per-agent work runs in `agents_step_kernel`, this method updates metrics and logs what happened.
 
         Parameters:
-        - agent_idx (int): Index of the agent performing the action.
-        - agent_action (Action): The action to be performed by the agent.
-            This is an instance of an Action enumeration that includes MOVE, KILL, FIX, and SABOTAGE actions.
+        - agent_actions (list or np.ndarray): Index of the action taken by each agent (see `self.agent_action_map`).
+        - agent_action_order (np.ndarray): Order in which the agents act.
+        - used_tag_actions (np.ndarray): Who has used their tag, updated in place.
+        - tag_counts (np.ndarray): Number of times each agent was tagged, updated in place.
         """
+        resolved_actions = self.agent_action_lut[self._agent_idxs, agent_actions]
+        assert np.all(resolved_actions >= 0), f"Invalid action(s) {agent_actions}"
+
+        n_kills, n_fixes, n_sabotages = agents_step_kernel(
+            agent_action_order,
+            resolved_actions,
+            self._move_table,
+            self.agent_cells,
+            self._cell_occupancy,
+            self.alive_agents,
+            self.imposter_mask,
+            self._job_at_cell,
+            self.completed_jobs,
+            used_tag_actions,
+            tag_counts,
+            self.agent_rewards,
+            self._rng.random(self.n_agents),
+            self.kill_reward,
+            self.complete_job_reward,
+            self.sabotage_reward,
+            self._action_targets,
+        )
 
-        if self.alive_agents[agent_idx] == 0:  # agent is dead
-            return
-
-        # get agent position
-        pos = self.agent_positions[agent_idx]
-
-        # moving the agent position
-        if agent_action.is_move_action:
-            new_pos = move(agent_action, pos)
-            if self._is_valid_position(new_pos):
-                self.agent_positions[agent_idx] = new_pos
-
-        # agent attempts kill action
-        elif agent_action == Action.KILL:
+        # only crew members can be killed
+        self._n_alive_crew -= n_kills
+        self._n_completed_jobs += n_fixes - n_sabotages
 
-            # who else is at this position
-            agents_at_pos = self._get_agents_at_pos(pos, crew_only=True)
+        self._ctr_killed_crew += n_kills
+        self._ctr_completed_jobs += n_fixes
+        self._ctr_sabotaged_jobs += n_sabotages
 
-            if agents_at_pos:
-                # choosing random victim
-                victim_idx = np.random.choice(agents_at_pos)
-                assert (
-                    victim_idx not in self.imposter_idxs
-                ), "Imposter cannot be killed. Only voted out!"
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log_agent_actions(resolved_actions, agent_action_order, tag_counts)
 
+    def _log_agent_actions(self, resolved_actions, agent_action_order, tag_counts) -> None:
+        for agent_idx in agent_action_order:
+            action = resolved_actions[agent_idx]
+            target = self._action_targets[agent_idx]
+
+            if action >= N_ACTIONS:
+                tagged = action - N_ACTIONS
+                if target >= 0:
+                    self.logger.debug(
+                        f"""Agent {agent_idx} ({self.agent_positions[agent_idx]}) tagged Agent {tagged} ({self.agent_positions[tagged]})! {tagged}'s new tag count: {tag_counts[tagged]}"""
+                    )
+                else:
+                    self.logger.debug(
+                        f"""Agent {agent_idx} tried to tag Agent {tagged} but failed!"""
+                    )
+            elif target < 0:
+                continue
+            elif action == ACT_KILL:
                 self.logger.debug(
                     f"""
-                Agent {victim_idx} ({self.agent_positions[victim_idx]}) got killed by {agent_idx} ({self.agent_positions[agent_idx]})!!!
+                Agent {target} ({self.agent_positions[target]}) got killed by {agent_idx} ({self.agent_positions[agent_idx]})!!!
                 """
                 )
-
-                self.metrics.increment(SusMetrics.IMP_KILLED_CREW, 1)
-
-                # updating alive list
-                self.alive_agents[victim_idx] = 0
-
-                # setting rewards
-                self.agent_rewards[victim_idx] = self.kill_reward
-                self.agent_rewards[agent_idx] = self.kill_reward
-
-        # agent attempts to fix
-        elif agent_action == Action.FIX:
-            job_idx = self._get_job_at_pos(pos)
-            if job_idx is not None and not self.completed_jobs[job_idx]:
-                self.completed_jobs[job_idx] = 1
-                self.metrics.increment(SusMetrics.COMPLETED_JOBS, 1)
-                self.agent_rewards[agent_idx] = self.complete_job_reward
-                self.logger.debug(f"Agent {agent_idx} fixed a job at {pos}!")
-
-        # agent attempts to sabotage
-        elif agent_action == Action.SABOTAGE:
-            job_idx = self._get_job_at_pos(pos)
-            if job_idx is not None and self.completed_jobs[job_idx]:
-                self.completed_jobs[job_idx] = 0
-                self.metrics.increment(SusMetrics.SABOTAGED_JOBS, 1)
-                self.agent_rewards[agent_idx] = -1 * self.sabotage_reward
-                self.logger.debug(f"Imposter {agent_idx} sabotaged a job at {pos}!")
-
-    def _get_agents_at_pos(self, pos, crew_only=True) -> List[int]:
-        if crew_only:
-            alive = np.argwhere(self.alive_agents & ~self.imposter_mask).flatten()
-        else:
-            alive = np.argwhere(self.alive_agents).flatten()
-
-        agents_at_pos = alive[np.all(self.agent_positions[alive] == pos, axis=1)]
-        return agents_at_pos.tolist()
-
-    def _get_job_at_pos(self, pos) -> int | None:
-        idx = np.argwhere(np.all(self.job_positions == pos, axis=1))
-        return idx[0][0] if idx.size > 0 else None
+            elif action == ACT_FIX:
+                self.logger.debug(
+                    f"Agent {agent_idx} fixed a job at {self.agent_positions[agent_idx]}!"
+                )
+            elif action == ACT_SABOTAGE:
+                self.logger.debug(
+                    f"Imposter {agent_idx} sabotaged a job at {self.agent_positions[agent_idx]}!"
+                )
 
     def _is_valid_position(self, pos):
         assert self.n_cols == self.n_rows  # this function assumes a square grid
-        valid = np.all(pos >= 0) and np.all(pos < self.n_cols)
-        return valid and self.grid[pos[1], pos[0]]
+        x, y = int(pos[0]), int(pos[1])
+        return 0 <= x < self.n_cols and 0 <= y < self.n_cols and self._valid_cell[y * self.n_cols + x]
 
     def _merge_rewards(self, agent_rewards, team_reward):
         """
@@ -559,14 +893,15 @@ Metrics:
         agent_rewards[: self.n_imposters] *= -1
 
         # no reward for dead agents
-        agent_rewards[self.alive_agents == 0] = self.dead_penalty
+        dead_agents = np.logical_not(self.alive_agents, out=self._agent_mask_scratch)
+        np.putmask(agent_rewards, dead_agents, self.dead_penalty)
         return agent_rewards
 
     def compute_state_dims(self, state_field: StateFields):
         """
         Computes the dimensions of the state field specified by the input argument.
         """
-        state_space = self.observation_space[state_field.value]
+        state_space = self.state_space[state_field.value]
 
         if isinstance(state_space, spaces.Box):
             ndim = len(state_space.shape)
@@ -579,4 +914,4 @@ Metrics:
             raise ValueError(f"Invalid state field: {state_field}")
 
     def compute_action(self, agent_idx, action_idx):
-        return str(Action(self.agent_action_map[agent_idx][action_idx]))
+        return ACTION_NAMES[self.agent_action_map[agent_idx][action_idx].value]
@@ -85,13 +85,13 @@ class ImposterTrainingGround(FourRoomEnv):
 
         # all jobs are done imposter loses
         # NOTE: this is only possible if n_jobs is not 0
-        if self.n_jobs != 0 and self.completed_jobs.sum() == self.n_jobs:
+        if self.n_jobs != 0 and self._n_completed_jobs == self.n_jobs:
             self.logger.debug("CREW won!")
             self.metrics.update(SusMetrics.CREW_WON, 1)
             return True, self.game_end_reward
 
         # imposter wins bu killing all crew
-        if self.alive_agents[self.crew_mask].sum() == 0:
+        if self._n_alive_crew == 0:
             self.logger.debug("Imposters won!")
             self.metrics.update(SusMetrics.IMPOSTER_WON, 1)
             return True, -1 * self.game_end_reward
@@ -1,9 +1,36 @@
+import logging
 from typing import Dict, Optional, Tuple
 import numpy as np
 from gymnasium import spaces
+from numba import njit
 
-from src.environment.base import FourRoomEnv, StateFields, Action
-from src.metrics import SusMetrics
+from src.environment.base import FourRoomEnv, StateFields, Action, ACTION_NAMES, N_ACTIONS
+
+
+@njit(cache=True)
+def tally_votes_kernel(tag_counts, alive_agents, quorum, vote_now):
+    """
+    Clears the tag counts of dead agents and, if `vote_now`, votes out the most tagged agent when its count reaches `quorum`.
+
+    Ties go to the lowest agent index (same as `np.argmax`). The voted out agent is marked dead in `alive_agents` in place.
+
+    Returns:
+    - tuple of (voted out agent index or -1, its tag count)
+    """
+    highest_vote_idx = 0
+    highest_vote = -1
+    for agent_idx in range(tag_counts.shape[0]):
+        if not alive_agents[agent_idx]:
+            tag_counts[agent_idx] = 0
+        if tag_counts[agent_idx] > highest_vote:
+            highest_vote = tag_counts[agent_idx]
+            highest_vote_idx = agent_idx
+
+    if not vote_now or highest_vote < quorum:
+        return -1, highest_vote
+
+    alive_agents[highest_vote_idx] = False
+    return highest_vote_idx, highest_vote
 
 
 class FourRoomEnvWithTagging(FourRoomEnv):
@@ -38,8 +65,15 @@ class FourRoomEnvWithTagging(FourRoomEnv):
         self.action_space = spaces.Discrete(
             len(Action) + self.n_agents
         )  # Add tagging action (1 for each agent)
+        self._action_n = self.action_space.n
+
+        # "Vote Player {k}" names of each agent's tag actions, every agent can vote for everyone but themselves
+        self._vote_names = [
+            [f"Vote Player {player}" for player in range(self.n_agents) if player != agent_idx]
+            for agent_idx in range(self.n_agents)
+        ]
 
-        self.observation_space = spaces.Tuple(
+        self.state_space = spaces.Tuple(
             (
                 spaces.Box(
                     low=0, high=self.n_rows, shape=(self.n_agents, 2), dtype=int
@@ -58,9 +92,10 @@ class FourRoomEnvWithTagging(FourRoomEnv):
                 ),  # Time left for tag reset
             )
         )
+        self._build_flat_layout()
 
-    def reset(self, seed: Optional[int] = None, **kwargs) -> Tuple[Tuple, Dict]:
-        state, _ = super().reset(seed, **kwargs)
+    def reset(self, seed: Optional[int] = None, **kwargs) -> Tuple[np.ndarray, Dict]:
+        super().reset(seed, **kwargs)
         self.tag_counts = np.zeros(self.n_agents, dtype=int)
         self.used_tag_actions = np.zeros(self.n_agents, dtype=bool)
         self.tag_reset_timer = 0
@@ -73,14 +108,16 @@ class FourRoomEnvWithTagging(FourRoomEnv):
             self.agent_action_map[agent_idx] = np.hstack(
                 [self.agent_action_map[agent_idx], tag_actions]
             )
+        self._build_action_lut()
 
-        self.logger.debug(
-            f"""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"""
 New Game Started!
 -----------------
     Agent Positions: {list(map(tuple, self.agent_positions))}
-    Imposters: {np.argwhere(self.imposter_mask).flatten()}
-    Crew Members: {np.argwhere(~self.imposter_mask).flatten()}
+    Imposters: {np.flatnonzero(self.imposter_mask)}
+    Crew Members: {np.flatnonzero(self.crew_mask)}
     Alive Agents: {self.alive_agents}
     Job Positions: {list(map(tuple, self.job_positions))}
     Completed Jobs: {self.completed_jobs}
@@ -88,35 +125,11 @@ New Game Started!
     Used Tag Actions: {self.used_tag_actions}
     Time Left for Tag Reset: {self.tag_reset_interval - self.tag_reset_timer}
 -----------------
-        """
-        )
-
-        state = (
-            *state,
-            self.used_tag_actions,
-            self.tag_counts,
-            self.tag_reset_interval - self.tag_reset_timer,
-        )
-
-        return state, {}
-
-    def _agent_tag(self, agent_idx, agent_tagged):
-        """Can only tag someone if your tag is unused and if the tagged agent is alive."""
-        if (
-            self.used_tag_actions[agent_idx] == 0
-            and self.alive_agents[agent_tagged] > 0
-        ):
-            self.tag_counts[agent_tagged] += 1
-            self.used_tag_actions[agent_idx] = 1
-
-            self.logger.debug(
-                f"""Agent {agent_idx} ({self.agent_positions[agent_idx]}) tagged Agent {agent_tagged} ({self.agent_positions[agent_tagged]})! {agent_tagged}'s new tag count: {self.tag_counts[agent_tagged]}"""
-            )
-        else:
-            self.logger.debug(
-                f"""Agent {agent_idx} tried to tag Agent {agent_tagged} but failed!"""
+            """
             )
 
+        return self._get_obs(), {}
+
     def step(self, agent_actions):
         """
         Executes a step in the environment by applying the actions of all agents and updating the environment's state accordingly.
@@ -131,7 +144,7 @@ New Game Started!
 
         Returns:
         - tuple containing:
-            - A tuple of (agent_position, job_positions, completed_jobs, alive_agents, used_tag_actions, agent_tag_count, time_till_vote_reset) reflecting the new state of the environment.
+            - The flat observation of (agent_position, alive_agents, job_positions, completed_jobs, used_tag_actions, agent_tag_count, time_till_vote_reset) reflecting the new state of the environment (see `to_tuple`).
             - agent_rewards (numpy.ndarray): An array of rewards received by each agent during this step.
             - done (bool): A flag indicating whether the game has reached a terminal state.
             - truncated (bool): A flag indicating whether the episode was truncated (not applicable in this context, but included for API consistency).
@@ -146,10 +159,10 @@ New Game Started!
             len(agent_actions) == self.n_agents
         ), f"Expected {self.n_agents} actions, got {len(agent_actions)}"
         assert all(
-            action < self.action_space.n for action in agent_actions
+            action < self._action_n for action in agent_actions
         ), f"Invalid action(s) {agent_actions}"
 
-        self.metrics.increment(SusMetrics.TOTAL_TIME_STEPS, 1)
+        self._ctr_total_steps += 1
 
         # kill agents who have been tagged too many times (tag count > half the number of agents)
 
@@ -159,51 +172,51 @@ New Game Started!
         team_reward = 0
 
         # initialize the agent reward array before computing all agent rewards
-        self.agent_rewards = np.ones(self.n_agents) * self.time_step_reward
+        self._agent_rewards_buf.fill(self.time_step_reward)
+        self.agent_rewards = self._agent_rewards_buf
 
         # getting the order in which agent actions will be performed
-        agent_action_order = list(range(self.n_agents))
+        agent_action_order = self._action_order_buf
         if self.is_action_order_random:
-            np.random.shuffle(agent_action_order)
+            self._rng.shuffle(agent_action_order)
 
         # perform action for each agent
-        for agent_idx in agent_action_order:
-
-            agent_action = self.agent_action_map[agent_idx][agent_actions[agent_idx]]
-
-            if isinstance(agent_action, int):  # this is a tag action
-                self._agent_tag(agent_idx=agent_idx, agent_tagged=agent_action)
-
-            else:
-                self._agent_step(agent_idx=agent_idx, agent_action=agent_action)
-
-        self.tag_counts *= self.alive_agents  # reset tag counts for dead agents
+        self._agents_step(
+            agent_actions,
+            agent_action_order,
+            used_tag_actions=self.used_tag_actions,
+            tag_counts=self.tag_counts,
+        )
 
         self.tag_reset_timer += 1
+        vote_now = self.tag_reset_timer >= self.tag_reset_interval
+        quorum = (self._n_alive_imposters + self._n_alive_crew + 1) // 2
 
-        if self.tag_reset_timer >= self.tag_reset_interval:
-            highest_vote_idx = np.argmax(self.tag_counts)
-            highest_vote = self.tag_counts[highest_vote_idx]
-
-            quorum = (self.alive_agents.sum() + 1) // 2
+        # resets tag counts for dead agents and kicks out the agent with the highest vote if it reached quorum
+        voted_out_idx, highest_vote = tally_votes_kernel(
+            self.tag_counts, self.alive_agents, quorum, vote_now
+        )
 
-            if highest_vote >= quorum:
-                self.alive_agents[highest_vote_idx] = (
-                    0  # kick out the agent with the highest vote
-                )
-                is_imposter = self.imposter_mask[highest_vote_idx]
-                # Reward Crew if Imposter is voted out, else reward Imposters (team reward penalizes the team that lost a member)
-                team_reward += self.vote_reward * (-1 if is_imposter else 1)
+        if voted_out_idx >= 0:
+            is_imposter = self.imposter_mask[voted_out_idx]
+            # Reward Crew if Imposter is voted out, else reward Imposters (team reward penalizes the team that lost a member)
+            team_reward += self.vote_reward * (-1 if is_imposter else 1)
 
-                if is_imposter:
-                    self.metrics.increment(SusMetrics.IMP_VOTED_OUT, 1)
-                else:
-                    self.metrics.increment(SusMetrics.CREW_VOTED_OUT, 1)
+            if is_imposter:
+                self._n_alive_imposters -= 1
+                self._ctr_imp_voted_out += 1
+            else:
+                self._n_alive_crew -= 1
+                self._ctr_crew_voted_out += 1
 
-                self.logger.debug(
-                    f"""Agent {highest_vote_idx} got voted OUT! Tag Count / Alive Agents: {highest_vote} / {self.alive_agents.sum()}"""
-                )
+            self.logger.debug(
+                "Agent %d got voted OUT! Tag Count / Alive Agents: %d / %d",
+                voted_out_idx,
+                highest_vote,
+                self._n_alive_imposters + self._n_alive_crew,
+            )
 
+        if vote_now:
             self._reset_tagging_state()
 
         team_win, win_team_reward = self.check_win_condition()
@@ -218,20 +231,22 @@ New Game Started!
             self.t += 1
 
         return (
-            (
-                self.agent_positions,
-                self.alive_agents,
-                self.job_positions,
-                self.completed_jobs,
-                self.used_tag_actions,  # Who has used their tag
-                self.tag_counts,  # Tag counts
-                self.tag_reset_interval
-                - self.tag_reset_timer,  # Time left for tag reset
-            ),
+            self._get_obs(),
             self.agent_rewards,
             done,
             truncated,
-            self.metrics.get_metrics(),
+            self.get_metrics(),
+        )
+
+    def _get_state(self) -> Tuple:
+        return (
+            self.agent_positions,
+            self.alive_agents,
+            self.job_positions,
+            self.completed_jobs,
+            self.used_tag_actions,  # Who has used their tag
+            self.tag_counts,  # Tag counts
+            self.tag_reset_interval - self.tag_reset_timer,  # Time left for tag reset
         )
 
     def _reset_tagging_state(self):
@@ -241,9 +256,7 @@ New Game Started!
         self.logger.debug("Tagging state reset!")
 
     def compute_action(self, agent_idx, action_idx):
-        if action_idx < len(Action):
-            return str(Action(action_idx))
+        if action_idx < N_ACTIONS:
+            return ACTION_NAMES[action_idx]
         else:
-            players = np.arange(self.n_agents)
-            player = players[players != agent_idx][action_idx - len(Action)]
-            return f"Vote Player {player}"
\ No newline at end of file
+            return self._vote_names[agent_idx][action_idx - N_ACTIONS]
\ No newline at end of file
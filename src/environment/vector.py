@@ -0,0 +1,428 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+from numba import njit, prange
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from src.environment.base import FourRoomEnv, agents_step_kernel
+from src.metrics import SusMetrics
+
+
+@njit(parallel=True, cache=True)
+def batched_agents_step_kernel(
+    agent_action_orders,
+    resolved_actions,
+    move_table,
+    agent_cells,
+    cell_occupancy,
+    alive_agents,
+    imposter_mask,
+    job_at_cell,
+    completed_jobs,
+    used_tag_actions,
+    tag_counts,
+    agent_rewards,
+    victim_draws,
+    kill_reward,
+    complete_job_reward,
+    sabotage_reward,
+    action_targets,
+    event_counts,
+):
+    """
+    Runs `agents_step_kernel` on every environment of the batch in parallel.
+
+    All array arguments but `move_table`, which is shared, carry a leading environment dimension. The number of kills, completed jobs and
+    sabotaged jobs of each environment are written to the (n_envs, 3) `event_counts` array.
+    """
+    for env_idx in prange(agent_cells.shape[0]):
+        n_kills, n_fixes, n_sabotages = agents_step_kernel(
+            agent_action_orders[env_idx],
+            resolved_actions[env_idx],
+            move_table,
+            agent_cells[env_idx],
+            cell_occupancy[env_idx],
+            alive_agents[env_idx],
+            imposter_mask[env_idx],
+            job_at_cell[env_idx],
+            completed_jobs[env_idx],
+            used_tag_actions[env_idx],
+            tag_counts[env_idx],
+            agent_rewards[env_idx],
+            victim_draws[env_idx],
+            kill_reward,
+            complete_job_reward,
+            sabotage_reward,
+            action_targets[env_idx],
+        )
+        event_counts[env_idx, 0] = n_kills
+        event_counts[env_idx, 1] = n_fixes
+        event_counts[env_idx, 2] = n_sabotages
+
+
+class FourRoomVecEnv(VectorEnv):
+    """
+    Runs `n_envs` independent FourRoomEnv games at once, storing the state of every game in batched arrays.
+
+    The state arrays mirror the ones of FourRoomEnv with a leading environment dimension, e.g. `agent_cells`
+    and `alive_agents` are (n_envs, n_agents). A step of all environments runs in a single
+    pass of NumPy operations plus one parallel numba kernel, so the Python overhead is paid once per batch.
+
+    Environments that terminate or truncate are reset within the same step (AutoresetMode.SAME_STEP).
+    Observations are the flat FourRoomEnv observations stacked into a (n_envs, flattened_state_size) array.
+    Observations returned by `step` are those of the new episodes, `infos["final_obs"]` holds the observations at
+    the end of the step (before resetting) and `infos["_final_obs"]` flags the environments that were reset.
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(
+        self,
+        n_envs: int,
+        n_imposters: int,
+        n_crew: int,
+        n_jobs: int,
+        random_state: Optional[int] = None,
+        **env_kwargs,
+    ):
+        """
+        Initializes the batched environment.
+
+        Parameters:
+            n_envs (int): Number of environments to run in parallel.
+            n_imposters (int): Number of imposters in each environment.
+            n_crew (int): Number of crew members in each environment.
+            n_jobs (int): Number of jobs in each environment.
+            random_state (int, optional): Seed for the random number generator.
+            env_kwargs: Any other FourRoomEnv argument (rewards, max_time_steps, include_walls, ...).
+        """
+        assert n_envs > 0, f"Must have at least one environment. Got {n_envs}."
+
+        # single environment, source of truth for the map, rewards, action sets and spaces
+        self.single_env = FourRoomEnv(
+            n_imposters=n_imposters, n_crew=n_crew, n_jobs=n_jobs, **env_kwargs
+        )
+        self._rng = np.random.default_rng(random_state)
+
+        self.num_envs = n_envs
+        self.n_imposters = n_imposters
+        self.n_crew = n_crew
+        self.n_agents = self.single_env.n_agents
+        self.n_jobs = n_jobs
+        self.state_fields = self.single_env.state_fields
+        self.grid = self.single_env.grid
+        self.valid_positions = self.single_env.valid_positions
+        self.flattened_state_size = self.single_env.flattened_state_size
+
+        self.single_observation_space = self.single_env.observation_space
+        self.single_action_space = spaces.MultiDiscrete(
+            [self.single_env.action_space.n] * self.n_agents
+        )
+        self.observation_space = batch_space(self.single_observation_space, n_envs)
+        self.action_space = batch_space(self.single_action_space, n_envs)
+
+        # Action value of each crew/imposter action, padded with -1 (see FourRoomEnv._build_action_lut)
+        n_actions = max(self.single_env.n_crew_actions, self.single_env.n_imposter_actions)
+        self._crew_action_values = np.full(n_actions, -1, dtype=np.int8)
+        self._crew_action_values[: self.single_env.n_crew_actions] = [
+            action.value for action in self.single_env.crew_actions
+        ]
+        self._imposter_action_values = np.full(n_actions, -1, dtype=np.int8)
+        self._imposter_action_values[: self.single_env.n_imposter_actions] = [
+            action.value for action in self.single_env.imposter_actions
+        ]
+
+        # batched state
+        self.agent_cells = np.zeros((n_envs, self.n_agents), dtype=np.uint8)
+        self._cell_occupancy = np.zeros(
+            (n_envs, self.single_env.n_rows * self.single_env.n_cols), dtype=np.int64
+        )
+        self.alive_agents = np.zeros((n_envs, self.n_agents), dtype=bool)
+        self.imposter_mask = np.zeros((n_envs, self.n_agents), dtype=bool)
+        self.imposter_idxs = np.zeros((n_envs, n_imposters), dtype=int)
+        self.job_cells = np.zeros((n_envs, n_jobs), dtype=np.uint8)
+        self._job_at_cell = np.full(
+            (n_envs, self.single_env.n_rows * self.single_env.n_cols), -1, dtype=np.int16
+        )
+        self.completed_jobs = np.zeros((n_envs, n_jobs), dtype=bool)
+        self.agent_action_lut = np.full(
+            (n_envs, self.n_agents, n_actions), -1, dtype=np.int8
+        )
+        self.t = np.zeros(n_envs, dtype=int)
+        self.metrics = {metric: np.zeros(n_envs, dtype=int) for metric in SusMetrics}
+
+        # step buffers
+        self.agent_rewards = np.zeros((n_envs, self.n_agents))
+        self._default_action_order = np.tile(np.arange(self.n_agents), (n_envs, 1))
+        self._no_used_tag_actions = np.zeros((n_envs, self.n_agents), dtype=bool)
+        self._no_tag_counts = np.zeros((n_envs, self.n_agents), dtype=int)
+        self._action_targets = np.full((n_envs, self.n_agents), -1, dtype=int)
+        self._event_counts = np.zeros((n_envs, 3), dtype=int)
+        # reset and step write their observation here, it is overwritten by the next call
+        self._obs_buf = np.empty(
+            (n_envs, self.flattened_state_size), dtype=self.single_observation_space.dtype
+        )
+
+    def reset(
+        self, seed: Optional[int] = None, options: Optional[Dict] = None
+    ) -> Tuple[np.ndarray, Dict]:
+        """
+        Resets every environment of the batch.
+
+        Args:
+        - seed (int): An optional seed to use for the random number generator.
+        Returns:
+        Tuple: A tuple containing the initial (n_envs, flattened_state_size) observations and the batched metrics
+        """
+        if seed is not None:
+            self._rng = np.random.default_rng(seed)
+
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+
+        return self._get_obs(), self._get_metrics()
+
+    def _reset_envs(self, env_mask: np.ndarray) -> None:
+        """
+        Resets the environments flagged in `env_mask`, following the same rules as FourRoomEnv.reset.
+        """
+        env_idxs = np.flatnonzero(env_mask)
+        n_reset = len(env_idxs)
+        if n_reset == 0:
+            return
+
+        for metric_values in self.metrics.values():
+            metric_values[env_idxs] = 0
+
+        # determining imposter positions
+        if self.single_env.shuffle_imposter_index:
+            imposter_idxs = np.argsort(
+                self._rng.random((n_reset, self.n_agents)), axis=1
+            )[:, : self.n_imposters]
+        else:
+            imposter_idxs = np.tile(np.arange(self.n_imposters), (n_reset, 1))
+
+        imposter_mask = np.zeros((n_reset, self.n_agents), dtype=bool)
+        np.put_along_axis(imposter_mask, imposter_idxs, True, axis=1)
+        self.imposter_idxs[env_idxs] = imposter_idxs
+        self.imposter_mask[env_idxs] = imposter_mask
+
+        # random agent positions
+        valid_cells = self.single_env.valid_cells
+        agent_cells = valid_cells[
+            self._rng.integers(0, len(valid_cells), size=(n_reset, self.n_agents))
+        ]
+        self.agent_cells[env_idxs] = agent_cells
+        cell_occupancy = np.zeros((n_reset, self._cell_occupancy.shape[1]), dtype=np.int64)
+        np.bitwise_or.at(
+            cell_occupancy,
+            (np.arange(n_reset)[:, None], agent_cells),
+            1 << np.arange(self.n_agents, dtype=np.int64),
+        )
+        self._cell_occupancy[env_idxs] = cell_occupancy
+
+        # random job positions
+        # NOTE: any two jobs can't be at the same position
+        job_cells = valid_cells[
+            np.argsort(self._rng.random((n_reset, len(valid_cells))), axis=1)[
+                :, : self.n_jobs
+            ]
+        ]
+        self.job_cells[env_idxs] = job_cells
+        job_at_cell = np.full((n_reset, self._job_at_cell.shape[1]), -1, dtype=np.int16)
+        np.put_along_axis(
+            job_at_cell, job_cells.astype(int), np.arange(self.n_jobs, dtype=np.int16)[None], axis=1
+        )
+        self._job_at_cell[env_idxs] = job_at_cell
+
+        self.alive_agents[env_idxs] = True
+        self.completed_jobs[env_idxs] = False
+
+        self.agent_action_lut[env_idxs] = np.where(
+            imposter_mask[..., None],
+            self._imposter_action_values,
+            self._crew_action_values,
+        )
+
+        self.t[env_idxs] = 0
+
+    def sample_actions(self) -> np.ndarray:
+        n_actions = np.where(
+            self.imposter_mask,
+            self.single_env.n_imposter_actions,
+            self.single_env.n_crew_actions,
+        )
+        return self._rng.integers(0, n_actions)
+
+    def step(self, agent_actions):
+        """
+        Executes a step in every environment of the batch, following the same rules as FourRoomEnv.step.
+
+        Parameters:
+        - agent_actions (np.ndarray): (n_envs, n_agents) array of the action index taken by each agent in each environment.
+
+        Returns:
+        - tuple containing:
+            - The batched observations of the environments (new episodes for the environments that were reset).
+            - agent_rewards (numpy.ndarray): (n_envs, n_agents) array of the rewards received by each agent.
+            - terminated (numpy.ndarray): Whether each environment reached a terminal state.
+            - truncated (numpy.ndarray): Whether each environment was truncated.
+            - info (dict): The batched metrics of each episode, plus `final_obs` and `_final_obs`.
+        """
+        agent_actions = np.asarray(agent_actions)
+        assert agent_actions.shape == (
+            self.num_envs,
+            self.n_agents,
+        ), f"Expected actions of shape {(self.num_envs, self.n_agents)}, got {agent_actions.shape}"
+
+        self.metrics[SusMetrics.TOTAL_TIME_STEPS] += 1
+
+        # initialize the agent reward array before computing all agent rewards
+        self.agent_rewards.fill(0)
+
+        # getting the order in which agent actions will be performed
+        if self.single_env.is_action_order_random:
+            agent_action_orders = np.argsort(
+                self._rng.random((self.num_envs, self.n_agents)), axis=1
+            )
+        else:
+            agent_action_orders = self._default_action_order
+
+        resolved_actions = np.take_along_axis(
+            self.agent_action_lut, agent_actions[..., None], axis=2
+        )[..., 0]
+        assert np.all(resolved_actions >= 0), f"Invalid action(s) {agent_actions}"
+
+        batched_agents_step_kernel(
+            agent_action_orders,
+            resolved_actions,
+            self.single_env._move_table,
+            self.agent_cells,
+            self._cell_occupancy,
+            self.alive_agents,
+            self.imposter_mask,
+            self._job_at_cell,
+            self.completed_jobs,
+            self._no_used_tag_actions,
+            self._no_tag_counts,
+            self.agent_rewards,
+            self._rng.random((self.num_envs, self.n_agents)),
+            self.single_env.kill_reward,
+            self.single_env.complete_job_reward,
+            self.single_env.sabotage_reward,
+            self._action_targets,
+            self._event_counts,
+        )
+
+        self.metrics[SusMetrics.IMP_KILLED_CREW] += self._event_counts[:, 0]
+        self.metrics[SusMetrics.COMPLETED_JOBS] += self._event_counts[:, 1]
+        self.metrics[SusMetrics.SABOTAGED_JOBS] += self._event_counts[:, 2]
+
+        terminated, team_reward = self.check_win_condition()
+        self._merge_rewards(team_reward)
+
+        truncated = self.t == self.single_env.max_time_steps - 1
+        self.t[~truncated] += 1
+
+        info = self._get_metrics()
+
+        # resetting finished environments
+        finished = terminated | truncated
+        if finished.any():
+            info["final_obs"] = self._get_obs().copy()
+            info["_final_obs"] = finished
+            self._reset_envs(finished)
+
+        return self._get_obs(), self.agent_rewards, terminated, truncated, info
+
+    def check_win_condition(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Checks which environments reached a terminal state, with the same win conditions as FourRoomEnv.check_win_condition.
+
+        Returns:
+        - tuple containing:
+            - A boolean array indicating which environments reached a terminal state.
+            - The team reward of each environment.
+        """
+        alive_imposters = np.sum(self.alive_agents & self.imposter_mask, axis=1)
+        alive_crew = np.sum(self.alive_agents, axis=1) - alive_imposters
+
+        crew_won = (alive_imposters == 0) | (
+            np.sum(self.completed_jobs, axis=1) == self.n_jobs
+        )
+        imposters_won = ~crew_won & (alive_crew <= alive_imposters)
+
+        self.metrics[SusMetrics.CREW_WON][crew_won] = 1
+        self.metrics[SusMetrics.IMPOSTER_WON][imposters_won] = 1
+
+        team_reward = self.single_env.game_end_reward * (
+            crew_won.astype(int) - imposters_won.astype(int)
+        )
+        return crew_won | imposters_won, team_reward
+
+    def _merge_rewards(self, team_reward: np.ndarray) -> None:
+        """
+        Merges the rewards for each agent with the team reward (see FourRoomEnv._merge_rewards).
+        """
+        self.agent_rewards += team_reward[:, None]
+        # negate imposters rewards
+        self.agent_rewards[:, : self.n_imposters] *= -1
+
+        # no reward for dead agents
+        self.agent_rewards[~self.alive_agents] = self.single_env.dead_penalty
+
+        zero_rewards = self.agent_rewards == 0
+        self.agent_rewards[zero_rewards] = self.single_env.time_step_reward
+
+    @property
+    def agent_positions(self):
+        return self.single_env._cell_to_xy[self.agent_cells]
+
+    @property
+    def job_positions(self):
+        return self.single_env._cell_to_xy[self.job_cells]
+
+    def _get_state(self) -> Tuple:
+        return (
+            self.agent_positions,
+            self.alive_agents,
+            *([self.job_positions, self.completed_jobs] if self.n_jobs > 0 else []),
+        )
+
+    def _get_obs(self) -> np.ndarray:
+        return self.flatten_state(self._get_state(), out=self._obs_buf)
+
+    def _get_metrics(self) -> Dict[SusMetrics, np.ndarray]:
+        return {metric: values.copy() for metric, values in self.metrics.items()}
+
+    def flatten_state(self, state, out=None):
+        """
+        Flattens a batched state into a (n_envs, flattened_state_size) array, see FourRoomEnv.flatten_state.
+        """
+        # observations are already flat
+        if not isinstance(state, tuple):
+            return np.asarray(state)
+
+        flat_state = (
+            np.empty(
+                (self.num_envs, self.flattened_state_size),
+                dtype=self.single_observation_space.dtype,
+            )
+            if out is None
+            else out
+        )
+        for (field_slice, _, _), field in zip(self.single_env._flat_layout, state):
+            flat_state[:, field_slice] = np.reshape(field, (self.num_envs, -1))
+        return flat_state
+
+    def unflatten_state(self, state):
+        """
+        Unflattens the observation of a single environment, see FourRoomEnv.unflatten_state.
+        """
+        return self.single_env.unflatten_state(state)
+
+    def to_tuple(self, obs):
+        """
+        Splits a single environment's flat observation back into its state tuple, see FourRoomEnv.to_tuple.
+        """
+        return self.single_env.to_tuple(obs)
@@ -66,7 +66,32 @@ class SequenceStateFeaturizer(ABC):
         """
         raise NotImplementedError("Need to implement fit method.")
 
+    # attributes holding the fitted (B, T, ...) feature sequences, in the order `_featurize_state` returns them
+    _feature_names: Tuple[str, ...] = ()
+
+    def fit_incremental(self, state: torch.Tensor) -> None:
+        """
+        Appends a new last state to the fitted sequences and drops the oldest one. Only the new state is featurized,
+        equivalent to calling `fit` on the shifted sequence.
+
+        Parameters:
+            state (torch.Tensor): The new states, (B, S).
+        """
+        batch_states = [self.env.unflatten_state(s) for s in state]
+        for name, new_features in zip(self._feature_names, self._featurize_state(batch_states)):
+            features = getattr(self, name)
+            setattr(self, name, torch.cat([features[:, 1:], new_features.unsqueeze(1)], dim=1))
+
     @abstractmethod
+    def featurize_all(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns the featurized state from every agent's perspective, stacked along a leading agent dimension.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Spatial (n_agents, B, T, ...) and non-spatial (n_agents, B, T, F) features.
+        """
+        raise NotImplementedError("Need to implement featurize_all method.")
+
     def generate_featurized_states(self) -> List[Tuple[torch.Tensor, torch.Tensor]]:
         """
         Returns the featurized state from each agent's perspective.
@@ -74,9 +99,11 @@ class SequenceStateFeaturizer(ABC):
         Returns:
             List[Tuple[torch.Tensor, torch.Tensor]]: List of spatial and non-spatial features.
         """
-        raise NotImplementedError(
-            "Need to implement generate_featurized_states method."
-        )
+        spatial, non_spatial = self.featurize_all()
+        return [
+            (spatial[agent_idx], non_spatial[agent_idx])
+            for agent_idx in range(self.env.n_agents)
+        ]
 
 
 class PerspectiveFeaturizer(SequenceStateFeaturizer):
@@ -90,6 +117,8 @@ class PerspectiveFeaturizer(SequenceStateFeaturizer):
     - Non-spatial are also ordered based on the agent in question.
     """
 
+    _feature_names = ("spatial", "agent_non_spatial", "global_non_spatial")
+
     def __init__(self, env: FourRoomEnv):
         super().__init__(env)
 
@@ -112,6 +141,14 @@ class PerspectiveFeaturizer(SequenceStateFeaturizer):
             ]
         )
 
+        # agent order from each agent's perspective: itself first, then everyone else by index
+        self._agent_orders = torch.stack(
+            [
+                torch.cat([torch.tensor([agent_idx]), torch.arange(agent_idx), torch.arange(agent_idx + 1, env.n_agents)])
+                for agent_idx in range(env.n_agents)
+            ]
+        )
+
     @property
     def featurized_shape(self):
         non_spatial_shape = torch.sum(
@@ -172,48 +209,37 @@ class PerspectiveFeaturizer(SequenceStateFeaturizer):
 
         return spatial_features, agent_non_spatial_features, global_non_spatial_features
 
-    def generate_featurized_states(self) -> List[Tuple[torch.Tensor, torch.Tensor]]:
-        spatial_rep = self.spatial.detach().clone()
-        agent_non_spatial_rep = self.agent_non_spatial.detach().clone()
-        global_non_spatial_rep = self.global_non_spatial.detach().clone()
-
-        featurized = []
-
-        C = spatial_rep.size(2)  # number of channels size (B, T, C, H, W)
-
-        agents = torch.arange(self.env.n_agents)
-
-        channel_order = torch.arange(C)
-
-        for agent_idx in range(self.env.n_agents):
-            channel_order[0] = agent_idx
-            agents[0] = agent_idx
-            if agent_idx > 0:
-                channel_order[agent_idx] = agent_idx - 1
-                agents[agent_idx] = agent_idx - 1
-
-            non_spatial = torch.cat(
-                [
-                    agent_non_spatial_rep[:, :, :, agents]
-                    .detach()
-                    .clone()
-                    .view(self.B, self.T, -1),
-                    global_non_spatial_rep,
-                ],
-                dim=2,
-            )
+    def featurize_all(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        C = self.spatial.size(2)  # number of channels size (B, T, C, H, W)
+        n_agents = self.env.n_agents
 
-            featurized.append(
-                (
-                    spatial_rep[:, :, channel_order, :, :]
-                    .detach()
-                    .clone()
-                    .requires_grad_(True),
-                    non_spatial.requires_grad_(True),
-                )
-            )
+        # the agent in question moves to the front, others keep their order (agent channels come first, then jobs)
+        channel_orders = torch.cat(
+            [
+                self._agent_orders,
+                torch.arange(n_agents, C).expand(n_agents, C - n_agents),
+            ],
+            dim=1,
+        )
+
+        # (B, T, N, C, H, W) -> (N, B, T, C, H, W)
+        spatial = self.spatial[:, :, channel_orders].movedim(2, 0).contiguous()
+
+        # (B, T, F, N, n_agents) -> (N, B, T, F * n_agents)
+        agent_non_spatial = (
+            self.agent_non_spatial[:, :, :, self._agent_orders]
+            .movedim(3, 0)
+            .reshape(n_agents, self.B, self.T, -1)
+        )
+        non_spatial = torch.cat(
+            [
+                agent_non_spatial,
+                self.global_non_spatial.expand(n_agents, *self.global_non_spatial.shape),
+            ],
+            dim=3,
+        )
 
-        return featurized
+        return spatial, non_spatial
 
 
 class GlobalFeaturizer(SequenceStateFeaturizer):
@@ -224,6 +250,8 @@ class GlobalFeaturizer(SequenceStateFeaturizer):
     GlobalFeaturizer does not shift ordering of channels based on the agent in question. Instead we just simply append one-hot encoding of the agent index to the non-spatial features.
     """
 
+    _feature_names = ("spatial", "non_spatial")
+
     def __init__(self, env: FourRoomEnv):
         super().__init__(env)
 
@@ -288,22 +316,20 @@ class GlobalFeaturizer(SequenceStateFeaturizer):
 
         return spatial_features, non_spatial_features
 
-    def generate_featurized_states(self) -> Tuple[torch.Tensor, torch.Tensor]:
-        featurized = []
-        for agent_idx in range(self.env.n_agents):
-            agent_idx_tensor = torch.zeros(self.B, self.T, self.env.n_agents)
-            agent_idx_tensor[:, :, agent_idx] = 1
-
-            featurized.append(
-                (
-                    self.spatial.detach().clone().requires_grad_(True),
-                    torch.cat(
-                        [self.non_spatial.detach().clone(), agent_idx_tensor], dim=2
-                    ).requires_grad_(True),
-                )
-            )
+    def featurize_all(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        n_agents = self.env.n_agents
+        # one-hot of the agent in question, (N, B, T, N)
+        agent_idx_tensor = (
+            torch.eye(n_agents).view(n_agents, 1, 1, n_agents).expand(n_agents, self.B, self.T, n_agents)
+        )
 
-        return featurized
+        return (
+            self.spatial.expand(n_agents, *self.spatial.shape),
+            torch.cat(
+                [self.non_spatial.expand(n_agents, *self.non_spatial.shape), agent_idx_tensor],
+                dim=3,
+            ),
+        )
 
 
 class FlatFeaturizer(SequenceStateFeaturizer):
@@ -311,6 +337,8 @@ class FlatFeaturizer(SequenceStateFeaturizer):
     Quite simple, just return the flattened state.
     """
 
+    _feature_names = ("featurized_state",)
+
     def __init__(self, env: FourRoomEnv, featurizer: CompositeFeaturizer):
         super().__init__(env)
         self.featurizer = featurizer
@@ -353,18 +381,15 @@ class FlatFeaturizer(SequenceStateFeaturizer):
         self.featurized_state = torch.stack(feature_sequence_list)
         self.featurized_state = self.featurized_state.transpose(0, 1)
 
-    def generate_featurized_states(self) -> Tuple[torch.Tensor, torch.Tensor]:
-        featurized = []
-        for agent_idx in range(self.env.n_agents):
-             
-            featurized.append(
-                (
-                    torch.zeros(self.B, self.T, 1).requires_grad_(True),
-                    self.featurized_state.detach().clone().requires_grad_(True),
-                )
-            )
+    def _featurize_state(self, batch_state) -> Tuple[torch.Tensor]:
+        return (torch.stack([self.featurizer.extract_features(state) for state in batch_state]),)
+
+    def featurize_all(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        n_agents = self.env.n_agents
+        return (
+            torch.zeros(1, self.B, self.T, 1).expand(n_agents, self.B, self.T, 1),
+            self.featurized_state.expand(n_agents, *self.featurized_state.shape),
+        )
 
-        return featurized
-    
     def __repr__(self) -> str:
         return f"FlatFeaturizer_{self.featurizer}"
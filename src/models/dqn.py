@@ -1,6 +1,7 @@
 from typing import List
 import torch
 from torch import nn
+import torch.nn.functional as F
 from enum import StrEnum, auto
 
 from src.utils import calculate_cnn_output_dim
@@ -50,6 +51,19 @@ class ActivationType(StrEnum):
             raise ValueError(f"Activation function {self} not supported")
 
 
+class RNNType(StrEnum):
+    RNN = auto()
+    GRU = auto()
+
+    def build(self, **kwargs):
+        if self == RNNType.RNN:
+            return nn.RNN(**kwargs)
+        elif self == RNNType.GRU:
+            return nn.GRU(**kwargs)
+        else:
+            raise ValueError(f"RNN type {self} not supported")
+
+
 class Q_Estimator(nn.Module):
     def __init__(self):
         super(Q_Estimator, self).__init__()
@@ -59,6 +73,11 @@ class Q_Estimator(nn.Module):
     def model_type(self):
         raise NotImplementedError("model_type property not implemented")
 
+    def act(self, *inputs):
+        """Q-values for action selection, run in inference mode (no autograd or view tracking)."""
+        with torch.inference_mode():
+            return self(*inputs)
+
     def dump_to_checkpoint(self, filepath):
         raise NotImplementedError("dump_to_checkpoint method not implemented")
 
@@ -89,13 +108,18 @@ class MLP(nn.Module):
         out = self.model(x)
         return out
 
+    def act(self, spatial_x, non_spatial_x):
+        with torch.inference_mode():
+            return self(spatial_x, non_spatial_x)
+
     def dump_to_checkpoint(model, filepath):
         checkpoint = {"state_dict": model.state_dict(), "config": model.config}
         torch.save(checkpoint, filepath)
         print(f"Model checkpoint saved to {filepath}")
     
     def load_from_checkpoint(filepath):
-        checkpoint = torch.load(filepath)
+        # loaded on the host, callers move the model (checkpoints of gpu runs hold cuda tensors)
+        checkpoint = torch.load(filepath, map_location="cpu")
         config = checkpoint["config"]
         model = MLP(**config)
         model.load_state_dict(checkpoint["state_dict"])
@@ -115,14 +139,13 @@ class RandomEquiprobable(Q_Estimator):
 
     def forward(self, *inputs):
         batch_size = 1  # default batch size if no inputs are provided
+        device = "cpu"
         if inputs:
             batch_size = inputs[0].shape[0]
+            device = inputs[0].device
 
-        random_indices = torch.randint(0, self.n_outputs, (batch_size,))
-        outputs = torch.zeros(batch_size, self.n_outputs)
-        outputs[torch.arange(batch_size), random_indices] = 1
-
-        return outputs
+        random_indices = torch.randint(0, self.n_outputs, (batch_size,), device=device)
+        return F.one_hot(random_indices, self.n_outputs).float()
 
     @property
     def model_type(self):
@@ -188,9 +211,11 @@ class RNNModel(nn.Module):
         n_layers: int,
         hidden_dim: int,
         dropout: float,
+        rnn_type: RNNType = RNNType.RNN,
     ):
         super(RNNModel, self).__init__()
-        self.model = nn.RNN(
+        # GRU has fused cuDNN kernels, the vanilla RNN often doesn't
+        self.model = RNNType(rnn_type).build(
             input_size=input_dim,
             hidden_size=hidden_dim,
             num_layers=n_layers,
@@ -198,6 +223,12 @@ class RNNModel(nn.Module):
             batch_first=True,
         )
 
+    def _apply(self, fn, *args, **kwargs):
+        ret = super()._apply(fn, *args, **kwargs)
+        # keep the weights in one contiguous block after moving devices so cuDNN doesn't re-pack them every call
+        self.model.flatten_parameters()
+        return ret
+
     def forward(self, x):
         return self.model(x)  # (output, hidden state)
 
@@ -222,6 +253,8 @@ class SpatialDQN(Q_Estimator):
         # MLP arguments
         mlp_hidden_layer_dims: List[int],
         n_actions: int,
+        rnn_type: RNNType = RNNType.RNN,
+        compile_layers: bool = False,
     ):
         super(SpatialDQN, self).__init__()
 
@@ -236,6 +269,8 @@ class SpatialDQN(Q_Estimator):
             "rnn_layers": rnn_layers,
             "rnn_hidden_dim": rnn_hidden_dim,
             "rnn_dropout": rnn_dropout,
+            "rnn_type": RNNType(rnn_type).value,  # plain str so checkpoints load with weights_only
+            "compile_layers": compile_layers,
             "mlp_hidden_layer_dims": mlp_hidden_layer_dims,
             "n_actions": n_actions,
         }
@@ -256,6 +291,8 @@ class SpatialDQN(Q_Estimator):
             kernel_size=kernel_size,
             dilations=dilations,
         )
+        # NHWC lets cuDNN pick its tensor core conv kernels
+        self.cnn = self.cnn.to(memory_format=torch.channels_last)
 
         self.rnn_in_dim = (
             self.cnn_ouput_dim**2 * n_channels[-1] + non_spatial_input_size
@@ -267,6 +304,7 @@ class SpatialDQN(Q_Estimator):
             n_layers=rnn_layers,
             hidden_dim=rnn_hidden_dim,
             dropout=rnn_dropout,
+            rnn_type=rnn_type,
         )
 
         # MLP Prediction head
@@ -276,29 +314,87 @@ class SpatialDQN(Q_Estimator):
             layer_dims=self.mlp_dims, activation_fn=ActivationType.PRELU
         )
 
+        if compile_layers:
+            # let inductor fuse each conv/linear with the activation after it. Only the feature dims are fixed by
+            # the config, the batch changes every call (team samples in train_step, greedy agents at selection),
+            # so dynamo is left to mark it dynamic after the first recompile. Compiled in place to keep the
+            # state_dict keys
+            self.cnn.compile()
+            self.prediction_head.compile()
+
+        # CUDA graphs of the inference forward, captured lazily by act() for each input shape
+        self._graphs = {}
+
     @property
     def model_type(self):
         return ModelType.SPATIAL_DQN
 
-    def forward(self, spatial_x, non_spatial_x):
-
-        # running through CNN
-        batch_size, timesteps, C, H, W = spatial_x.size()
-        cnn_in = spatial_x.view(batch_size * timesteps, C, H, W)
-        cnn_out = self.cnn(cnn_in)
-        # Reshape the output for the RNN
+    def act(self, spatial_x, non_spatial_x):
+        """
+        Q-values for action selection. On the gpu the forward is replayed from a CUDA graph
+        captured for the input shapes, which skips the per-layer kernel launch overhead.
+        """
+        # the graphs' static buffers are inference tensors, so capture and every replay stay in inference mode
+        with torch.inference_mode():
+            return self._act(spatial_x, non_spatial_x)
+
+    def _act(self, spatial_x, non_spatial_x):
+        device = next(self.parameters()).device
+        if device.type != "cuda":
+            return self(spatial_x, non_spatial_x)
+
+        key = (tuple(spatial_x.shape), tuple(non_spatial_x.shape), self.training)
+        if key not in self._graphs:
+            self._graphs[key] = self._capture_graph(spatial_x, non_spatial_x, device)
+        graph, static_spatial, static_non_spatial, static_out = self._graphs[key]
+
+        static_spatial.copy_(spatial_x)
+        static_non_spatial.copy_(non_spatial_x)
+        graph.replay()
+        return static_out.clone()
+
+    def _capture_graph(self, spatial_x, non_spatial_x, device):
+        static_spatial = torch.empty(spatial_x.shape, dtype=torch.float32, device=device)
+        static_non_spatial = torch.empty(non_spatial_x.shape, dtype=torch.float32, device=device)
+        static_spatial.copy_(spatial_x)
+        static_non_spatial.copy_(non_spatial_x)
+
+        with torch.no_grad():
+            # warm up on a side stream so the capture sees initialized cuDNN/cuBLAS state
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    self(static_spatial, static_non_spatial)
+            torch.cuda.current_stream().wait_stream(stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                static_out = self(static_spatial, static_non_spatial)
+
+        return graph, static_spatial, static_non_spatial, static_out
 
+    def forward(self, spatial_x, non_spatial_x):
 
-        cnn_out = cnn_out.view(batch_size, timesteps, -1)
-        # appending non-spatial features
-        rnn_in = torch.cat((cnn_out, non_spatial_x), dim=2)
-
-        rnn_out, _ = self.rnn(rnn_in)
-        # Use the last hidden state to predict with MLP
-        mlp_in = rnn_out[:, -1, :]
-        out = self.prediction_head(mlp_in)
-
-        return out
+        # bf16 on the gpu for tensor core convs/matmuls and half the activation traffic, bf16 needs no loss scaling
+        with torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=spatial_x.is_cuda):
+            # running through CNN
+            batch_size, timesteps, C, H, W = spatial_x.size()
+            cnn_in = spatial_x.view(batch_size * timesteps, C, H, W)
+            cnn_in = cnn_in.contiguous(memory_format=torch.channels_last)
+            cnn_out = self.cnn(cnn_in)
+            # Reshape the output for the RNN, back in NCHW order so the flattened features keep their layout
+            cnn_out = cnn_out.contiguous().view(batch_size, timesteps, -1)
+            # appending non-spatial features
+            rnn_in = torch.cat((cnn_out, non_spatial_x), dim=2).contiguous()
+
+            rnn_out, _ = self.rnn(rnn_in)
+            # Use the last hidden state to predict with MLP
+            mlp_in = rnn_out[:, -1, :]
+            out = self.prediction_head(mlp_in)
+
+        # the losses are computed in fp32
+        return out.float()
 
     def dump_to_checkpoint(model, filepath):
         checkpoint = {"state_dict": model.state_dict(), "config": model.config}
@@ -306,7 +402,8 @@ class SpatialDQN(Q_Estimator):
         print(f"Model checkpoint saved to {filepath}")
 
     def load_from_checkpoint(filepath):
-        checkpoint = torch.load(filepath)
+        # loaded on the host, callers move the model (checkpoints of gpu runs hold cuda tensors)
+        checkpoint = torch.load(filepath, map_location="cpu")
         config = checkpoint["config"]
         model = SpatialDQN(**config)
         model.load_state_dict(checkpoint["state_dict"])
@@ -1,5 +1,6 @@
 import numpy as np
 import torch
+from typing import Optional
 from collections import namedtuple
 
 # Batch namedtuple, i.e. a class which contains the given attributes
@@ -16,6 +17,10 @@ class ReplayBuffer:
         trajectory_size: int,
         n_agents: int,
         n_imposters: int,
+        device: Optional[torch.device] = None,
+        state_dtype: torch.dtype = torch.uint8,
+        store_on_device: bool = False,
+        seed: Optional[int] = None,
     ):
 
         assert max_size > 0, "Replay buffer size must be positive"
@@ -28,20 +33,67 @@ class ReplayBuffer:
         self.state_size = state_size
         self.n_agents = n_agents
         self.n_imposters = n_imposters
+        self.device = torch.device("cpu") if device is None else torch.device(device)
+        # observations are small ints, they're stored as is and only cast to float when sampled
+        self.state_dtype = state_dtype
 
-        # initializing the timestep buffer
-        self.states = torch.empty(
-            (self.max_size, self.trajectory_size, self.state_size)
+        # keeping the storage on the device removes the per batch host to device copy, at the cost of device memory
+        self.store_on_device = store_on_device
+        self._storage_device = self.device if store_on_device else torch.device("cpu")
+
+        # sample indices come from the buffer's own generator, sample() may run on a prefetch thread and must not
+        # interleave draws with the global generator used by the main thread. Without a seed it is seeded from the
+        # global generator, so torch.manual_seed still makes the whole run reproducible
+        if seed is None:
+            seed = int(torch.randint(2**62, ()).item())
+        self._generator = torch.Generator(device=self._storage_device)
+        self._generator.manual_seed(seed)
+
+        # batches headed for the gpu are gathered into a pinned staging buffer so the copy can run async
+        self._pin = (
+            not store_on_device and self.device.type == "cuda" and torch.cuda.is_available()
         )
-        self.actions = torch.empty((self.max_size, self.n_agents), dtype=torch.long)
-        self.rewards = torch.empty((self.max_size, self.n_agents))
-        self.next_states = torch.empty(
-            (self.max_size, self.trajectory_size, self.state_size)
+        self._staging = None
+        self._copy_event = None
+
+        # unpinned batches are gathered into preallocated slots that are refilled in place, two of them
+        # alternate so the previous batch stays valid while the next one is sampled
+        self._batch_slots = None
+        self._next_slot = 0
+
+        # every field of a transition lives in one byte row so sampling is a single gather,
+        # each field starts 8 byte aligned so it can be viewed with its own dtype
+        field_specs = Batch(
+            states=((self.trajectory_size, self.state_size), self.state_dtype),
+            actions=((self.n_agents,), torch.long),
+            rewards=((self.n_agents,), torch.float32),
+            next_states=((self.trajectory_size, self.state_size), self.state_dtype),
+            imposters=((self.n_imposters,), torch.int16),
+            dones=((1,), torch.bool),
         )
-        self.dones = torch.empty((self.max_size, 1), dtype=torch.bool)
-        self.imposters = torch.empty(
-            (self.max_size, self.n_imposters), dtype=torch.int16
+        self._layout = []
+        offset = 0
+        for shape, dtype in field_specs:
+            n_bytes = int(np.prod(shape)) * torch.tensor([], dtype=dtype).element_size()
+            self._layout.append((offset, n_bytes, shape, dtype))
+            offset += -(-n_bytes // 8) * 8
+        self._row_bytes = offset
+
+        # initializing the timestep buffer
+        self._buffer = torch.empty(
+            (self.max_size, self._row_bytes),
+            dtype=torch.uint8,
+            device=self._storage_device,
+            pin_memory=self._pin,
         )
+        (
+            self.states,
+            self.actions,
+            self.rewards,
+            self.next_states,
+            self.imposters,
+            self.dones,
+        ) = self._field_views(self._buffer)
 
         # initializing current index and buffer size
         self.idx = 0
@@ -59,18 +111,58 @@ class ReplayBuffer:
             - done (bool): Whether the episode ended
             - imposters (np.ndarray): List of imposter indices
         """
-        self.states[self.idx] = torch.tensor(state)
-        self.actions[self.idx] = torch.tensor(action)
-        self.rewards[self.idx] = torch.tensor(reward)
-        self.next_states[self.idx] = torch.tensor(next_state)
-        self.dones[self.idx] = torch.tensor(done)
-        self.imposters[self.idx] = torch.tensor(imposters)
+        # copy straight into the preallocated slots, from_numpy shares the numpy memory instead of copying it first
+        self.states[self.idx].copy_(torch.from_numpy(np.ascontiguousarray(state)))
+        self.actions[self.idx].copy_(torch.from_numpy(np.ascontiguousarray(action)))
+        self.rewards[self.idx].copy_(torch.from_numpy(np.ascontiguousarray(reward)))
+        self.next_states[self.idx].copy_(torch.from_numpy(np.ascontiguousarray(next_state)))
+        self.dones[self.idx] = bool(done)
+        self.imposters[self.idx].copy_(torch.from_numpy(np.ascontiguousarray(imposters)))
 
         # Circulate the pointer to the next position
         self.idx = (self.idx + 1) % self.max_size
         # Update the current buffer size
         self.size = min(self.size + 1, self.max_size)
 
+    def add_many(self, states, actions, rewards, next_states, dones, imposters):
+        """
+        Add a block of transitions to the buffer, one slice copy per field instead of one `add` per transition.
+
+        Parameters
+            - states (np.ndarray): Current states, (K, trajectory_size, state_size)
+            - actions (np.ndarray): Actions taken, (K, n_agents)
+            - rewards (np.ndarray): Rewards received, (K, n_agents)
+            - next_states (np.ndarray): Next states, (K, trajectory_size, state_size)
+            - dones (np.ndarray): Whether each episode ended, (K,)
+            - imposters (np.ndarray): Imposter indices, (K, n_imposters)
+        """
+        n_transitions = len(states)
+        if n_transitions == 0:
+            return
+
+        # only the last `max_size` transitions would survive the ring buffer anyway
+        skip = max(0, n_transitions - self.max_size)
+        start = (self.idx + skip) % self.max_size
+        fields = [
+            (self.states, states),
+            (self.actions, actions),
+            (self.rewards, rewards),
+            (self.next_states, next_states),
+            (self.dones, np.reshape(dones, (-1, 1))),
+            (self.imposters, imposters),
+        ]
+        n_written = n_transitions - skip
+        # the destination range wraps around the end of the buffer at most once
+        first = min(n_written, self.max_size - start)
+        for dest, src in fields:
+            src = torch.as_tensor(src[skip:])
+            dest[start : start + first] = src[:first]
+            if first < n_written:
+                dest[: n_written - first] = src[first:]
+
+        self.idx = (self.idx + n_transitions) % self.max_size
+        self.size = min(self.size + n_transitions, self.max_size)
+
     def sample(self, batch_size) -> Batch:
         """Sample a batch of experiences.
 
@@ -82,15 +174,74 @@ class ReplayBuffer:
         """
         assert self.size > 0, "Replay buffer is empty, can't sample"
 
-        sample_idx = torch.randint(0, self.size, (batch_size,))
+        sample_idx = torch.randint(
+            0, self.size, (batch_size,), device=self._storage_device, generator=self._generator
+        )
+
+        if not self._pin:
+            if self._storage_device != self.device:
+                rows = torch.index_select(self._buffer, 0, sample_idx).to(self.device)
+                return self._as_float_states(self._field_views(rows))
+            return self._sample_into_slot(sample_idx)
+
+        if self._staging is None or self._staging.shape[0] != batch_size:
+            self._staging = torch.empty(
+                (batch_size, self._row_bytes), dtype=torch.uint8, pin_memory=True
+            )
+        # the previous batch's copy must finish before the staging buffer is overwritten
+        if self._copy_event is not None:
+            self._copy_event.synchronize()
+        torch.index_select(self._buffer, 0, sample_idx, out=self._staging)
 
+        rows = self._staging.to(self.device, non_blocking=True)
+        self._copy_event = torch.cuda.Event()
+        self._copy_event.record()
+        return self._as_float_states(self._field_views(rows))
+
+    def _sample_into_slot(self, sample_idx) -> Batch:
+        """
+        Gathers the sampled rows into the next preallocated batch slot, no new tensors are allocated.
+
+        A returned batch is overwritten two `sample` calls later.
+        """
+        batch_size = sample_idx.shape[0]
+        if self._batch_slots is None or self._batch_slots[0][0].shape[0] != batch_size:
+            self._batch_slots = []
+            for _ in range(2):
+                rows = torch.empty(
+                    (batch_size, self._row_bytes), dtype=torch.uint8, device=self._storage_device
+                )
+                states_shape = (batch_size, self.trajectory_size, self.state_size)
+                self._batch_slots.append(
+                    (
+                        rows,
+                        torch.empty(states_shape, device=self._storage_device),
+                        torch.empty(states_shape, device=self._storage_device),
+                    )
+                )
+
+        rows, states, next_states = self._batch_slots[self._next_slot]
+        self._next_slot = (self._next_slot + 1) % len(self._batch_slots)
+
+        torch.index_select(self._buffer, 0, sample_idx, out=rows)
+        batch = self._field_views(rows)
+        states.copy_(batch.states)
+        next_states.copy_(batch.next_states)
+        return batch._replace(states=states, next_states=next_states)
+
+    def _as_float_states(self, batch: Batch) -> Batch:
+        return batch._replace(
+            states=batch.states.float(), next_states=batch.next_states.float()
+        )
+
+    def _field_views(self, rows) -> Batch:
+        """Typed views of each transition field in a (n, row_bytes) uint8 tensor of buffer rows."""
+        n_rows = rows.shape[0]
         return Batch(
-            states=self.states[sample_idx],
-            actions=self.actions[sample_idx],
-            rewards=self.rewards[sample_idx],
-            imposters=self.imposters[sample_idx],
-            next_states=self.next_states[sample_idx],
-            dones=self.dones[sample_idx],
+            *(
+                rows[:, offset : offset + n_bytes].view(dtype).view(n_rows, *shape)
+                for offset, n_bytes, shape, dtype in self._layout
+            )
         )
 
     def populate(self, env, num_steps):
@@ -100,44 +251,54 @@ class ReplayBuffer:
         :param num_steps: Number of steps to populate the replay memory
         """
 
+        # transitions are staged in blocks and written with add_many
+        block_size = min(256, num_steps)
+        state_dtype = torch.empty(0, dtype=self.state_dtype).numpy().dtype
+        states = np.empty((block_size, self.trajectory_size, self.state_size), dtype=state_dtype)
+        next_states = np.empty_like(states)
+        actions = np.empty((block_size, self.n_agents), dtype=np.int64)
+        rewards = np.empty((block_size, self.n_agents), dtype=np.float32)
+        dones = np.empty(block_size, dtype=bool)
+        imposters = np.empty((block_size, self.n_imposters), dtype=np.int16)
+        n_staged = 0
+
+        state_sequence = np.empty((self.trajectory_size, self.state_size), dtype=state_dtype)
         step = 0
-        episode_id = 0
         while step < num_steps:
-            episode_id += 1
-            state_sequence = np.zeros((self.trajectory_size, self.state_size))
             s, _ = env.reset()
-            state = env.flatten_state(s)
             # fill the sequence with the current state for the first `trajectory_size` steps
-            for i in range(self.trajectory_size):
-                state_sequence[i] = state
+            state_sequence[:] = env.flatten_state(s)
 
             done = False
             truncation = False
             while not done and not truncation:
-                imposters = env.imposter_idxs
+                imposters[n_staged] = env.imposter_idxs
                 action = env.sample_actions()
                 n_s, reward, done, truncation, _ = env.step(action)
-                next_state = env.flatten_state(n_s)
-                next_sequence = np.roll(
-                    state_sequence.copy(), -1, axis=0
-                )  # shift the sequence by one step back (copying the array to avoid reference issues)
-                next_sequence[-1] = (
-                    next_state.copy()
-                )  # replace the last state in the sequence with the new state
-                self.add(
-                    state=state_sequence,
-                    action=action,
-                    reward=reward,
-                    next_state=next_sequence,
-                    done=done,
-                    imposters=imposters,
-                )
-                state = next_state
-                state_sequence = next_sequence
+
+                states[n_staged] = state_sequence
+                # shift the sequence by one step back and append the new state
+                next_states[n_staged, :-1] = state_sequence[1:]
+                next_states[n_staged, -1] = env.flatten_state(n_s)
+                actions[n_staged] = action
+                rewards[n_staged] = reward
+                dones[n_staged] = done
+                state_sequence[:] = next_states[n_staged]
+                n_staged += 1
                 step += 1
 
-                if done:
-                    break
+                if n_staged == block_size:
+                    self.add_many(states, actions, rewards, next_states, dones, imposters)
+                    n_staged = 0
 
                 if step >= num_steps:
                     break
+
+        self.add_many(
+            states[:n_staged],
+            actions[:n_staged],
+            rewards[:n_staged],
+            next_states[:n_staged],
+            dones[:n_staged],
+            imposters[:n_staged],
+        )
@@ -1,3 +1,9 @@
+import os
+
+# grow the CUDA caching allocator's segments in place instead of splitting fixed blocks, the per-team batches in
+# train_step change size every step and would otherwise fragment it. Read at the first CUDA allocation
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 from enum import StrEnum, auto
 from typing import Optional
 import numpy as np
@@ -5,6 +11,7 @@ import pygame
 import torch
 import torch.nn.functional as F
 import copy
+from concurrent.futures import ThreadPoolExecutor, wait
 import tqdm
 import pathlib
 from datetime import datetime
@@ -32,17 +39,40 @@ class OptimizerType(StrEnum):
         if model.model_type == ModelType.RANDOM:
             return None
         if optimizer_type == OptimizerType.ADAM:
+            # fused (cuda) / foreach update all parameters with a few multi-tensor kernels instead of a loop per parameter
+            on_cuda = next(model.parameters()).is_cuda
             return torch.optim.Adam(
-                params=model.parameters(), lr=learning_rate
+                params=model.parameters(),
+                lr=learning_rate,
+                **({"fused": True} if on_cuda else {"foreach": True}),
             )  # might need to make this more flexible in the future
 
 
+def bellman_squared_errors(values, rewards, next_max_values, done_mask, gamma: float):
+    """
+    Squared TD errors against the one step Bellman targets, done transitions bootstrap nothing. Written elementwise
+    (torch.where instead of a masked assignment) so torch.compile can fuse it into a single kernel.
+    """
+    target_values = torch.where(done_mask, rewards, rewards + gamma * next_max_values)
+    return (values - target_values) ** 2
+
+
 class DQNTeamTrainer:
 
-    def __init__(self, imposter_optimizer, crew_optimizer, gamma):
+    def __init__(
+        self, imposter_optimizer, crew_optimizer, gamma, compile_loss: bool = False, device: Optional[torch.device] = None
+    ):
         self.imposter_optimizer = imposter_optimizer
         self.crew_optimizer = crew_optimizer
         self.gamma = gamma
+        # device of the models, batches are featurized on the host and the team's rows are copied here
+        self.device = torch.device("cpu") if device is None else torch.device(device)
+        # the team batch size changes every step, so the compiled kernel is traced with dynamic shapes
+        self._squared_errors = (
+            torch.compile(bellman_squared_errors, dynamic=True)
+            if compile_loss
+            else bellman_squared_errors
+        )
 
         # whether or not this trainer is just a place holder!
         self.train = imposter_optimizer is not None or crew_optimizer is not None
@@ -67,85 +97,81 @@ class DQNTeamTrainer:
             if opt is not None:
                 opt.zero_grad()
 
-        featurizer.fit(batch.states)
-        featurized_state = featurizer.generate_featurized_states()
-
-        featurizer.fit(batch.next_states)
-        featurized_next_state = featurizer.generate_featurized_states()
-
-        for agent_idx, (state_feat, next_state_feat) in enumerate(
-            zip(featurized_state, featurized_next_state)
+        # features from every agent's perspective, (n_agents, B, T, ...). States and next states are featurized
+        # in one fit over the concatenated batch, features are computed per sample so splitting it back is exact
+        batch_size = batch.states.size(0)
+        featurizer.fit(torch.cat((batch.states, batch.next_states), dim=0))
+        all_spatial, all_non_spatial = featurizer.featurize_all()
+        spatial, next_spatial = all_spatial[:, :batch_size], all_spatial[:, batch_size:]
+        non_spatial, next_non_spatial = all_non_spatial[:, :batch_size], all_non_spatial[:, batch_size:]
+
+        # (n_agents, B) whether the agent is an imposter in each sample
+        agent_idxs = torch.arange(spatial.size(0), device=batch.imposters.device)
+        imposter_samples = (batch.imposters.unsqueeze(0) == agent_idxs.view(-1, 1, 1)).any(dim=2)
+
+        team_losses = []
+        team_optimizers = []
+
+        # each team is trained on all of its (agent, sample) pairs with one forward pass, the loss is the sum of
+        # the per agent MSE losses so the gradients match accumulating one loss per agent
+        for loss_idx, (opt, team_samples, team_model, team_model_target) in enumerate(
+            [
+                (self.imposter_optimizer, imposter_samples, imposter_model, imposter_target_model),
+                (self.crew_optimizer, ~imposter_samples, crew_model, crew_target_model),
+            ]
         ):
+            if opt is None or not team_samples.any():
+                continue
+
+            team_agents, team_batch_idxs = team_samples.nonzero(as_tuple=True)
+            # the featurizers read states through numpy so batches are featurized on the host, only the team's
+            # rows are copied to the models' device
+            team_spatial, team_non_spatial, team_next_spatial, team_next_non_spatial = (
+                features[team_agents, team_batch_idxs].to(self.device, non_blocking=True)
+                for features in (spatial, non_spatial, next_spatial, next_non_spatial)
+            )
+
+            team_model.train()
+            # compute the value of the actions taken by the agents (gradients are calculated here!)
+            action_values = team_model(team_spatial, team_non_spatial)
+            actions = batch.actions[team_batch_idxs, team_agents].to(self.device)
+            values = torch.gather(action_values, 1, actions.view(-1, 1)).view(-1)
+
+            # inference mode skips the version counter and view tracking, the targets are never differentiated
+            with torch.inference_mode():
+                done_mask = batch.dones[team_batch_idxs].view(-1).to(self.device)
+                rewards = batch.rewards[team_batch_idxs, team_agents].to(self.device)
+
+                # value of the best next action under the target network, no gradients here. SpatialDQN autocasts
+                # its own forward, the other targets (MLP) run in bf16 here on the gpu
+                with torch.autocast(
+                    device_type="cuda",
+                    dtype=torch.bfloat16,
+                    enabled=team_next_spatial.is_cuda and team_model_target.model_type != ModelType.SPATIAL_DQN,
+                ):
+                    next_action_values = team_model_target(team_next_spatial, team_next_non_spatial)
+                # the losses are computed in fp32
+                next_max_values = torch.max(next_action_values.float(), dim=1)[0]
+
+            # mean squared error of each agent, summed over the team's agents
+            agent_sample_counts = team_samples.sum(dim=1).clamp(min=1).to(self.device)
+            squared_errors = self._squared_errors(values, rewards, next_max_values, done_mask, self.gamma)
+            loss = (
+                values.new_zeros(len(agent_idxs)).index_add(0, team_agents.to(self.device), squared_errors)
+                / agent_sample_counts
+            ).sum()
+
+            team_losses.append(loss)
+            team_optimizers.append(opt)
+            accumulated_losses[loss_idx] = loss.item()
+
+        # the teams' parameters are disjoint, so one backward over the summed losses gives each optimizer its
+        # own team's gradients with a single autograd pass
+        if team_losses:
+            torch.stack(team_losses).sum().backward()
+            for opt in team_optimizers:
+                opt.step()
 
-            # samples in which agnets is an imposter/crew member
-            imposter_samples = (batch.imposters == agent_idx).view(-1)
-            crew_samples = ~imposter_samples
-
-            # spatial.requires_grad = non_spatial.requires_grad = True
-
-            # training via gradient accumulation
-            for loss_idx, (
-                opt,
-                team_samples,
-                team_model,
-                team_model_target,
-            ) in enumerate(
-                [
-                    (
-                        self.imposter_optimizer,
-                        imposter_samples,
-                        imposter_model,
-                        imposter_target_model,
-                    ),
-                    (self.crew_optimizer, crew_samples, crew_model, crew_target_model),
-                ]
-            ):
-                if opt is not None and team_samples.sum() > 0:
-                    team_model.train()
-                    # compute the value of the actions taken by the agent (gradients are calculated here!)
-
-                    action_values = team_model(
-                        state_feat[0][team_samples],
-                        state_feat[1][team_samples],
-                    )
-
-                    actions = torch.tensor(batch.actions[team_samples, agent_idx])
-
-                    values = torch.gather(action_values, 1, actions.view(-1, 1)).view(
-                        -1
-                    )
-
-                    with torch.no_grad():
-                        done_mask = batch.dones[team_samples].view(-1)
-
-                        rewards = torch.tensor(
-                            batch.rewards[team_samples, agent_idx]
-                        ).view(-1)
-
-                        # calculate target values, no gradients here (notice the detach() calls
-                        target_values = (
-                            rewards
-                            + self.gamma
-                            * torch.max(
-                                team_model_target(
-                                    next_state_feat[0][team_samples].detach(),
-                                    next_state_feat[1][team_samples].detach(),
-                                ),
-                                dim=1,
-                            )[0]
-                        )
-                        target_values[done_mask] = rewards[done_mask]
-
-                    loss = F.mse_loss(values, target_values)
-                    loss.backward()
-                    accumulated_losses[loss_idx] += loss.item()
-
-                    opt.step()
-
-        # use gradients to update models
-        # for opt in [self.imposter_optimizer, self.crew_optimizer]:
-        #     if opt is not None:
-        #         opt.step()
         return accumulated_losses
 
 
@@ -173,7 +199,18 @@ def run_experiment(
     train_step_interval: int = 5,
     num_checkpoint_saves: int = 5,
     target_update_interval: int = 10_000,
+    compile_models: bool = False,
+    cudnn_benchmark: bool = False,
+    device: Optional[torch.device] = None,
 ):
+    # cuDNN benchmarks every new input shape once and caches the fastest kernel for it. The team batches in
+    # train_step change size every step, so each new size pays a benchmark first and this only wins on long runs
+    # that keep revisiting the same (at most batch_size * n_agents) sizes. Restored when the run ends
+    previous_cudnn_benchmark = torch.backends.cudnn.benchmark
+    torch.backends.cudnn.benchmark = cudnn_benchmark
+
+    device = torch.device("cpu") if device is None else torch.device(device)
+
     # create a experiment dir
     if experiment_base_dir is None:        experiment_base_dir = BASE_REGISTRY_DIR / "experiments"
     
@@ -204,6 +241,9 @@ def run_experiment(
         'learning_rate': learning_rate,
         'train_step_interval': train_step_interval,
         "target_update_interval": target_update_interval,
+        "compile_models": compile_models,
+        "cudnn_benchmark": cudnn_benchmark,
+        "device": str(device),
     }
     
     # save the configs
@@ -211,10 +251,10 @@ def run_experiment(
         json.dump(experiment_config, f, cls=GeneralEncoder, indent=4)
 
     # initializing models
-    imposter_model = ModelType.build(imposter_model_type, **imposter_model_args)
-    crew_model = ModelType.build(crew_model_type, **crew_model_args)
+    imposter_model = ModelType.build(imposter_model_type, **imposter_model_args).to(device)
+    crew_model = ModelType.build(crew_model_type, **crew_model_args).to(device)
 
-    # initializing optimizers
+    # initializing optimizers (after moving the models, Adam picks its fused kernel for cuda parameters)
     crew_optimizer = imposter_optimizer = None
     if optimizer_type is not None:
         if train_imposter:
@@ -231,6 +271,8 @@ def run_experiment(
         imposter_optimizer=imposter_optimizer,
         crew_optimizer=crew_optimizer,
         gamma=gamma,
+        compile_loss=compile_models,
+        device=device,
     )
 
     # initialize scheduler
@@ -241,13 +283,15 @@ def run_experiment(
     # initialize metric handlers
     metrics = EpisodicMetricHandler()
 
-    # initialize replay buffer and prepopulate it
+    # initialize replay buffer and prepopulate it. Batches stay on the host, the featurizers read them through numpy
+    # and train_step copies the featurized rows to the device
     replay_buffer = ReplayBuffer(
         max_size=replay_buffer_size,
         trajectory_size=sequence_length,
         state_size=env.flattened_state_size,
         n_imposters=env.n_imposters,
         n_agents=env.n_agents,
+        state_dtype=torch.from_numpy(np.empty(0, dtype=env.observation_space.dtype)).dtype,
     )
 
     replay_buffer.populate(env=env, num_steps=replay_prepopulate_steps)
@@ -269,6 +313,8 @@ def run_experiment(
         trainer=trainer,
         num_saves=num_checkpoint_saves,
         target_update_interval=target_update_interval,
+        compile_models=compile_models,
+        device=device,
     )
 
     avg_metrics = metrics.compute()
@@ -278,6 +324,12 @@ def run_experiment(
     # run experiment
     metrics.save_metrics(save_file_path=experiment_dir / "metrics.json")
 
+    # hand the cached blocks of this run back to the driver, run_experiment is often called in a loop over configs
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    torch.backends.cudnn.benchmark = previous_cudnn_benchmark
+
     return metrics
 
 
@@ -297,31 +349,81 @@ def train(
     gamma: float = 0.99,
     num_saves: int = 5,
     target_update_interval: int = 10_000,
+    compile_models: bool = False,
+    device: Optional[torch.device] = None,
 ):
+    device = torch.device("cpu") if device is None else torch.device(device)
+
     returns = []
     game_lengths = []
     losses = []
-    rewards = []
 
-    imposter_target_model = imposter_model.create_copy()
-    crew_target_model = crew_model.create_copy()
+    # target networks are allocated once and synced in place with load_state_dict, they are never trained
+    imposter_target_model = imposter_model.create_copy().to(device)
+    crew_target_model = crew_model.create_copy().to(device)
+    for target_model in (imposter_target_model, crew_target_model):
+        target_model.eval()
+        target_model.requires_grad_(False)
+
+    if compile_models:
+        # compiled in place so the state_dict keys (checkpoints, target syncs) are unchanged. The team batch in
+        # train_step varies with the number of imposter samples, so dynamo is left to mark those dims dynamic
+        # instead of using reduce-overhead, which would record a new CUDA graph for every batch size
+        for model in (imposter_model, crew_model, imposter_target_model, crew_target_model):
+            model.compile()
 
     # Initialize structures to store the models at different stages of training
-    t_saves = np.linspace(0, num_steps, num_saves - 1, endpoint=False, dtype=int)
-    print(f"Saving models at steps: {t_saves}")
+    # set of ints so the per-step membership check is a hash lookup instead of a scan over the array
+    t_saves = set(
+        np.linspace(0, num_steps, num_saves - 1, endpoint=False, dtype=np.int64).tolist()
+    )
+    print(f"Saving models at steps: {sorted(t_saves)}")
 
     i_episode = 0  # Use this to indicate the index of the current episode
     t_episode = 0  # Use this to indicate the time-step inside current episode
 
     state, info = env.reset()  # Initialize state of first episode
 
-    state_sequence = np.zeros((replay_buffer.trajectory_size, replay_buffer.state_size))
-    for i in range(replay_buffer.trajectory_size):
-        state_sequence[i] = env.flatten_state(
-            state
-        )  # Initialize sequence with current state
+    # lookups that are fixed for the whole run, or for an episode (the imposters are redrawn on reset)
+    alive_agents_field = env.state_fields[StateFields.ALIVE_AGENTS]
+    imposter_mask = env.imposter_mask.copy()
+    crew_mask = ~imposter_mask
+    n_team_actions = np.where(imposter_mask, env.n_imposter_actions, env.n_crew_actions)
+
+    # sequences share the buffer's state dtype so adding them is a plain memcpy. The current and next sequence are
+    # overlapping views of one preallocated window, so stepping writes the new state in place instead of allocating
+    sequence_window = np.zeros(
+        (replay_buffer.trajectory_size + 1, replay_buffer.state_size),
+        dtype=env.observation_space.dtype,
+    )
+    state_sequence = sequence_window[:-1]
+    next_state_sequence = sequence_window[1:]
+    state_sequence[:] = env.flatten_state(state)  # Initialize sequence with current state
 
+    # per episode returns and per step actions are preallocated and reused
     G = np.zeros(env.n_agents)
+    agent_actions = np.zeros(env.n_agents, dtype=np.int32)
+
+    # action selection featurizes the current trajectory with its own copy of the featurizer (train_step refits the
+    # shared one on replay batches), so each step only the newest state has to be featurized
+    selection_featurizer = copy.copy(featurizer)
+    selection_featurizer.fit(
+        torch.from_numpy(state_sequence).unsqueeze(0)
+    )  # add batch dimension to state_sequence (features expect a batch dimension)
+
+    # uniform draws for the eps-greedy choices (explore? and which random action) are made in blocks,
+    # instead of two numpy RNG calls per agent per step
+    rng_block_size = 4096
+    # drawn from a stream spawned off the env's generator, so the env's random_state makes the run reproducible
+    action_rng = env.spawn_rng()
+
+    # the next training batch is sampled in the background while train_step runs, the replay buffer isn't
+    # written during train_step so the sampler never reads a half written transition. This lags sampling by one
+    # train step: the batch for a train step is drawn right after the previous one, so it never contains the
+    # latest `train_step_interval` transitions (including the one just added). With uniform replay over the whole
+    # buffer this is a negligible shift, the buffer's own generator keeps the draws reproducible across threads
+    prefetch_pool = ThreadPoolExecutor(max_workers=1)
+    next_batch = None
 
     # Iterate for a total of `num_steps` steps
     pbar = tqdm.trange(num_steps)
@@ -342,50 +444,44 @@ def train(
             imposter_target_model.load_state_dict(imposter_model.state_dict())
             crew_target_model.load_state_dict(crew_model.state_dict())
 
-        # featurizing current trajectory
-        featurizer.fit(
-            torch.tensor(state_sequence).unsqueeze(0)
-        )  # add batch dimension to state_sequence (features expect a batch dimension)
-
         # getting next action
         eps = scheduler.value(t_total)
-        agent_actions = np.zeros(env.n_agents, dtype=np.int32)
-        alive_agents = state[env.state_fields[StateFields.ALIVE_AGENTS]]
-
-        with torch.no_grad():
-            for agent_idx, (spatial, non_spatial) in enumerate(
-                featurizer.generate_featurized_states()
+        if t_total % rng_block_size == 0:
+            rng_block = action_rng.random((rng_block_size, 2, env.n_agents))
+        explore_draws, action_draws = rng_block[t_total % rng_block_size]
+        alive_agents = env.to_tuple(state)[alive_agents_field].astype(bool)
+        explore = explore_draws <= eps
+
+        # random actions for the exploring agents, dead agents stay (action 0)
+        agent_actions.fill(0)
+        explore_agents = np.flatnonzero(alive_agents & explore)
+        agent_actions[explore_agents] = action_draws[explore_agents] * n_team_actions[explore_agents]
+
+        # greedy actions, every team's greedy agents are evaluated in one batched model call
+        spatial, non_spatial = selection_featurizer.featurize_all()  # (n_agents, 1, T, ...)
+
+        # inference mode for action selection, train_step switches the models back to train mode
+        imposter_model.eval()
+        crew_model.eval()
+        with torch.inference_mode():
+            for team_mask, team_model in (
+                (imposter_mask, imposter_model),
+                (crew_mask, crew_model),
             ):
-
-                # choose action for alive imposter
-                if env.imposter_mask[agent_idx] and alive_agents[agent_idx]:
-
-                    if np.random.random() <= eps:
-                        agent_actions[agent_idx] = np.random.randint(
-                            0, env.n_imposter_actions
-                        )
-                    else:
-                        agent_actions[agent_idx] = int(
-                            torch.argmax(imposter_model(spatial, non_spatial))
-                        )
-
-                # choose action for alive crew member
-                elif alive_agents[agent_idx]:
-                    if np.random.random() <= eps:
-                        agent_actions[agent_idx] = np.random.randint(
-                            0, env.n_crew_actions
-                        )
-                    else:
-                        agent_actions[agent_idx] = int(
-                            torch.argmax(crew_model(spatial, non_spatial))
-                        )
+                greedy_agents = np.flatnonzero(team_mask & alive_agents & ~explore)
+                if len(greedy_agents) == 0:
+                    continue
+                agent_idxs = torch.from_numpy(greedy_agents)
+                action_values = team_model.act(
+                    spatial[agent_idxs, 0].to(device), non_spatial[agent_idxs, 0].to(device)
+                )
+                agent_actions[greedy_agents] = torch.argmax(action_values, dim=1).cpu().numpy()
 
         next_state, reward, done, trunc, info = env.step(agent_actions=agent_actions)
 
-        rewards.append(reward)
-        G = reward + gamma * G
+        G *= gamma
+        G += reward
 
-        next_state_sequence = np.roll(state_sequence.copy(), -1, axis=0)
         next_state_sequence[-1] = env.flatten_state(next_state)
 
         # adding the timestep to replay buffer
@@ -401,8 +497,13 @@ def train(
         # Training update for imposters and/or crew
         if t_total % train_step_interval == 0:
 
-            # get sample of trajectories to train on
-            batch = replay_buffer.sample(batch_size)
+            # get sample of trajectories to train on, prefetched during the previous train_step (one interval stale)
+            batch = (
+                next_batch.result()
+                if next_batch is not None
+                else replay_buffer.sample(batch_size)
+            )
+            next_batch = prefetch_pool.submit(replay_buffer.sample, batch_size)
 
             step_losses = trainer.train_step(
                 batch=batch,
@@ -412,14 +513,16 @@ def train(
                 crew_model=crew_model,
                 crew_target_model=crew_target_model,
             )
+            # the buffer is written again next step, the prefetched sample has to be complete by then
+            wait([next_batch])
 
             losses.append(step_losses)
 
         # checking if the env needs to be reset
         if done or trunc:
 
-            imposter_return = G[env.imposter_mask].mean().item()
-            crew_return = G[~env.imposter_mask].mean().item()
+            imposter_return = G[imposter_mask].mean().item()
+            crew_return = G[crew_mask].mean().item()
 
             returns.append([imposter_return, crew_return])
 
@@ -431,24 +534,29 @@ def train(
             )
             
             # resetting episode
-            rewards = []
             game_lengths.append(t_episode)
-            G = np.zeros(env.n_agents)
+            G.fill(0)
             t_episode = 0
             i_episode += 1
 
             state, _ = env.reset()
-            state_sequence = np.zeros(
-                (replay_buffer.trajectory_size, replay_buffer.state_size)
-            )
-            for i in range(replay_buffer.trajectory_size):
-                state_sequence[i] = env.flatten_state(state)
+            imposter_mask = env.imposter_mask.copy()
+            crew_mask = ~imposter_mask
+            n_team_actions = np.where(imposter_mask, env.n_imposter_actions, env.n_crew_actions)
+            state_sequence[:] = env.flatten_state(state)
+            selection_featurizer.fit(torch.from_numpy(state_sequence).unsqueeze(0))
 
         else:
             state = next_state
-            state_sequence = next_state_sequence
+            # slide the window by one state, the add above already copied both sequences out
+            state_sequence[:] = next_state_sequence
+            selection_featurizer.fit_incremental(
+                torch.from_numpy(state_sequence[-1:])
+            )
             t_episode += 1
 
+    prefetch_pool.shutdown()
+
     # saving final model states
     imposter_model.dump_to_checkpoint(
         save_directory_path / f"imposter_{imposter_model.model_type}_100%.pt"
@@ -314,10 +314,12 @@ class AmongUsVisualizer:
 
 
 class StateSequenceVisualizer:
-    def __init__(self, featurizer: SequenceStateFeaturizer, cmap="Blues"):
+    def __init__(self, featurizer: SequenceStateFeaturizer, cmap="Blues", show_coordinates: bool = True):
         # TODO: revisit giving imposter_positions to constructor, this is a hack
         self.featurizer = featurizer
         self.cmap = cmap
+        # one text artist per cell per channel dominates the plotting time, turn off for quick looks
+        self.show_coordinates = show_coordinates
 
     def visualize_global_state(self, imposters: torch.Tensor):
         for b, spatial in enumerate(torch.unbind(self.featurizer.spatial, dim=0)):
@@ -358,6 +360,10 @@ class StateSequenceVisualizer:
         cells = np.arange(n_rows)
         ticks = cells - 0.5
 
+        # labels and which cells are filled are computed once for the step, not by indexing the tensor per cell
+        coordinate_labels = [(x, y, str((x, y))) for y in cells for x in cells]
+        colored_cells = spatial[sequence_idx].numpy() != 0
+
         for channel_idx in range(n_channels):
             if channel_idx < n_agents:
                 is_imposter = channel_idx in imposters
@@ -376,18 +382,20 @@ class StateSequenceVisualizer:
             ax[channel_idx].set_yticklabels([], minor=False)
             ax[channel_idx].tick_params(axis="both", which="both", length=0)
 
-            for y in cells:
-                for x in cells:
-                    is_colored = spatial[sequence_idx, channel_idx, x, y]
-                    ax[channel_idx].text(
-                        x,
-                        n_rows - y - 1,
-                        str((x, y)),
-                        va="center",
-                        ha="center",
-                        fontsize=8,
-                        color="white" if is_colored else "black",
-                    )
+            if not self.show_coordinates:
+                continue
+
+            channel_colored = colored_cells[channel_idx]
+            for x, y, label in coordinate_labels:
+                ax[channel_idx].text(
+                    x,
+                    n_rows - y - 1,
+                    label,
+                    va="center",
+                    ha="center",
+                    fontsize=8,
+                    color="white" if channel_colored[x, y] else "black",
+                )
 
     def _visualize_sequence(
         self,
@@ -516,19 +524,22 @@ def run_game(
             n_imposters=visualizer.env.n_imposters,
             n_agents=visualizer.env.n_agents,
         )
-        state_sequence = np.zeros(
-            (replay_memory.trajectory_size, replay_memory.state_size)
+        # current and next sequence are overlapping views of one window, stepping shifts it in place
+        sequence_window = np.zeros(
+            (replay_memory.trajectory_size + 1, replay_memory.state_size)
         )
-        for i in range(replay_memory.trajectory_size):
-            state_sequence[i] = visualizer.env.flatten_state(state)
-        return state, replay_memory, state_sequence
+        sequence_window[:-1] = visualizer.env.flatten_state(state)
+        return state, replay_memory, sequence_window
     
     with AmongUsVisualizer(env) as visualizer:
-        state, replay_memory, state_sequence = reset_game(visualizer)
+        state, replay_memory, sequence_window = reset_game(visualizer)
+        state_sequence, next_state_sequence = sequence_window[:-1], sequence_window[1:]
 
         stop_game = False
         done = False
         paused = False
+        # tick() only sleeps for what is left of the frame after the inference and drawing, wait() always slept 250ms
+        clock = pygame.time.Clock()
         while not stop_game:
             for event in pygame.event.get():
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
@@ -540,33 +551,34 @@ def run_game(
                     break
                 # if you click r, reset the game
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-                    state, replay_memory, state_sequence = reset_game(visualizer)
+                    state, replay_memory, sequence_window = reset_game(visualizer)
+                    state_sequence, next_state_sequence = sequence_window[:-1], sequence_window[1:]
                     paused = False
                     done = False
 
             if not done and not paused:
-                featurizer.fit(state_sequence=torch.tensor(state_sequence).unsqueeze(0))
-                actions = []
-                action_strs = []
-
-                for agent_idx, (agent_spatial, agent_non_spatial) in enumerate(
-                    featurizer.generate_featurized_states()
+                featurizer.fit(state_sequence=torch.from_numpy(state_sequence).unsqueeze(0))
+                spatial, non_spatial = featurizer.featurize_all()  # (n_agents, 1, T, ...)
+                actions = np.zeros(env.n_agents, dtype=np.int32)
+
+                # one batched model call per team instead of one per agent
+                for team_mask, team_model in (
+                    (env.imposter_mask, imposter_model),
+                    (~env.imposter_mask, crew_model),
                 ):
-                    if agent_idx in env.imposter_idxs:
-                        action_probs = imposter_model(agent_spatial, agent_non_spatial)
-                        action = action_probs.argmax().item()
-                    else:
-                        action = crew_model(agent_spatial, agent_non_spatial).argmax().item()
-                    action_strs.append(env.compute_action(agent_idx, action))
-                    
-                    actions.append(action)
+                    team_agents = np.flatnonzero(team_mask)
+                    if len(team_agents) == 0:
+                        continue
+                    agent_idxs = torch.from_numpy(team_agents)
+                    action_values = team_model.act(spatial[agent_idxs, 0], non_spatial[agent_idxs, 0])
+                    actions[team_agents] = action_values.argmax(dim=1).numpy()
 
                 next_state, reward, done, truncated, _ = visualizer.step(actions)
 
                 if debug:
+                    action_strs = [env.compute_action(agent_idx, action) for agent_idx, action in enumerate(actions)]
                     print(f'Actions: {action_strs}')
 
-                next_state_sequence = np.roll(state_sequence.copy(), -1, axis=0)
                 next_state_sequence[-1] = env.flatten_state(next_state)
 
                 replay_memory.add(
@@ -579,9 +591,9 @@ def run_game(
                 )
 
                 state = next_state
-                state_sequence = next_state_sequence
+                state_sequence[:] = next_state_sequence
 
-            pygame.time.wait(250)
+            clock.tick(4)
         visualizer.close()
 
 
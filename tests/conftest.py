@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# the modules import each other as `src.<module>`, so the repo root has to be importable
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
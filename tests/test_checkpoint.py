@@ -0,0 +1,59 @@
+import pytest
+import torch
+
+from src.models.dqn import MLP, ModelType, RNNType, SpatialDQN
+
+
+SPATIAL_DQN_ARGS = dict(
+    input_image_size=9,
+    non_spatial_input_size=5,
+    n_channels=[3, 4],
+    strides=[1, 1],
+    paddings=[1, 1],
+    kernel_size=[3, 3],
+    dilations=[1, 1],
+    rnn_layers=1,
+    rnn_hidden_dim=8,
+    rnn_dropout=0.0,
+    mlp_hidden_layer_dims=[8],
+    n_actions=4,
+)
+
+
+def assert_same_state_dict(a, b):
+    a_state, b_state = a.state_dict(), b.state_dict()
+    assert a_state.keys() == b_state.keys()
+    for key in a_state:
+        assert torch.equal(a_state[key], b_state[key]), key
+
+
+@pytest.mark.parametrize("rnn_type", [RNNType.RNN, RNNType.GRU, "gru"])
+def test_spatial_dqn_checkpoint_round_trip(tmp_path, rnn_type):
+    torch.manual_seed(0)
+    model = SpatialDQN(**SPATIAL_DQN_ARGS, rnn_type=rnn_type)
+    filepath = tmp_path / "spatial_dqn.pt"
+    model.dump_to_checkpoint(filepath)
+
+    # loaded the same way a pretrained_model_path is, torch.load defaults to weights_only
+    loaded = ModelType.build(ModelType.SPATIAL_DQN, pretrained_model_path=filepath)
+
+    assert isinstance(loaded.rnn.model, type(model.rnn.model))
+    assert loaded.config == model.config
+    assert_same_state_dict(model, loaded)
+
+    spatial_x = torch.rand(2, 3, 3, 9, 9)
+    non_spatial_x = torch.rand(2, 3, 5)
+    assert torch.equal(model.act(spatial_x, non_spatial_x), loaded.act(spatial_x, non_spatial_x))
+
+
+def test_mlp_checkpoint_round_trip(tmp_path):
+    torch.manual_seed(0)
+    model = MLP(layer_dims=[6, 8, 3])
+    filepath = tmp_path / "mlp.pt"
+    model.dump_to_checkpoint(filepath)
+
+    loaded = ModelType.build(ModelType.MLP, pretrained_model_path=filepath)
+
+    assert_same_state_dict(model, loaded)
+    x = torch.rand(4, 6)
+    assert torch.equal(model.act(x, x), loaded.act(x, x))
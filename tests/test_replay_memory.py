@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+import torch
+
+from src.replay_memory import ReplayBuffer
+
+
+TRAJECTORY_SIZE, STATE_SIZE, N_AGENTS, N_IMPOSTERS = 3, 5, 4, 2
+
+
+def make_buffer(max_size, seed=0):
+    return ReplayBuffer(
+        max_size=max_size,
+        state_size=STATE_SIZE,
+        trajectory_size=TRAJECTORY_SIZE,
+        n_agents=N_AGENTS,
+        n_imposters=N_IMPOSTERS,
+        seed=seed,
+    )
+
+
+def make_transition(i):
+    """Transition `i`, every field is derived from `i` so rows can be traced back to the transition."""
+    states = ((i + np.arange(TRAJECTORY_SIZE * STATE_SIZE)) % 256).astype(np.uint8)
+    return dict(
+        state=states.reshape(TRAJECTORY_SIZE, STATE_SIZE),
+        action=np.arange(N_AGENTS) + i,
+        reward=(np.arange(N_AGENTS) - i * 0.5).astype(np.float32),
+        next_state=(states.reshape(TRAJECTORY_SIZE, STATE_SIZE) + 1).astype(np.uint8),
+        done=i % 3 == 0,
+        imposters=(np.arange(N_IMPOSTERS) + i) % N_AGENTS,
+    )
+
+
+def assert_row_is_transition(buffer_fields, row, i):
+    states, actions, rewards, next_states, imposters, dones = (field[row] for field in buffer_fields)
+    expected = make_transition(i)
+    assert np.array_equal(states.numpy(), expected["state"])
+    assert np.array_equal(actions.numpy(), expected["action"])
+    assert np.array_equal(rewards.numpy(), expected["reward"])
+    assert np.array_equal(next_states.numpy(), expected["next_state"])
+    assert np.array_equal(imposters.numpy(), expected["imposters"])
+    assert bool(dones.item()) == expected["done"]
+
+
+def buffer_fields(buffer):
+    return (buffer.states, buffer.actions, buffer.rewards, buffer.next_states, buffer.imposters, buffer.dones)
+
+
+def test_field_views_have_their_own_dtypes_and_shapes():
+    buffer = make_buffer(max_size=6)
+    assert buffer.states.dtype == torch.uint8
+    assert buffer.next_states.dtype == torch.uint8
+    assert buffer.actions.dtype == torch.long
+    assert buffer.rewards.dtype == torch.float32
+    assert buffer.imposters.dtype == torch.int16
+    assert buffer.dones.dtype == torch.bool
+    assert buffer.states.shape == (6, TRAJECTORY_SIZE, STATE_SIZE)
+    assert buffer.actions.shape == (6, N_AGENTS)
+    assert buffer.imposters.shape == (6, N_IMPOSTERS)
+    assert buffer.dones.shape == (6, 1)
+
+
+def test_add_wraps_around_the_ring_buffer():
+    max_size, n_transitions = 7, 17
+    buffer = make_buffer(max_size)
+    for i in range(n_transitions):
+        buffer.add(**make_transition(i))
+
+    assert buffer.size == max_size
+    assert buffer.idx == n_transitions % max_size
+    # the last `max_size` transitions survive, transition i lives in row i % max_size
+    for i in range(n_transitions - max_size, n_transitions):
+        assert_row_is_transition(buffer_fields(buffer), i % max_size, i)
+
+
+@pytest.mark.parametrize("block_sizes", [[3, 4, 5], [6, 6, 6], [2, 11, 1], [20], [1] * 9])
+def test_add_many_matches_add(block_sizes):
+    max_size = 7
+    single, block = make_buffer(max_size), make_buffer(max_size)
+
+    i = 0
+    for block_size in block_sizes:
+        transitions = [make_transition(i + k) for k in range(block_size)]
+        for transition in transitions:
+            single.add(**transition)
+        block.add_many(
+            states=np.stack([t["state"] for t in transitions]),
+            actions=np.stack([t["action"] for t in transitions]),
+            rewards=np.stack([t["reward"] for t in transitions]),
+            next_states=np.stack([t["next_state"] for t in transitions]),
+            dones=np.array([t["done"] for t in transitions]),
+            imposters=np.stack([t["imposters"] for t in transitions]),
+        )
+        i += block_size
+
+    assert (block.idx, block.size) == (single.idx, single.size)
+    for single_field, block_field in zip(buffer_fields(single), buffer_fields(block)):
+        assert torch.equal(single_field[: single.size], block_field[: block.size])
+
+
+def test_sample_returns_stored_transitions():
+    max_size, n_transitions, batch_size = 9, 14, 16
+    buffer = make_buffer(max_size)
+    for i in range(n_transitions):
+        buffer.add(**make_transition(i))
+
+    batch = buffer.sample(batch_size)
+
+    # states are cast to float for the featurizers, every other field keeps its storage dtype
+    assert batch.states.dtype == torch.float32
+    assert batch.next_states.dtype == torch.float32
+    assert batch.actions.dtype == torch.long
+    assert batch.rewards.dtype == torch.float32
+    assert batch.imposters.dtype == torch.int16
+    assert batch.dones.dtype == torch.bool
+    assert batch.states.shape == (batch_size, TRAJECTORY_SIZE, STATE_SIZE)
+
+    stored = set(range(n_transitions - max_size, n_transitions))
+    for row in range(batch_size):
+        i = int(batch.states[row, 0, 0].item())
+        assert i in stored
+        sampled_fields = (
+            batch.states.to(torch.uint8),
+            batch.actions,
+            batch.rewards,
+            batch.next_states.to(torch.uint8),
+            batch.imposters,
+            batch.dones,
+        )
+        assert_row_is_transition(sampled_fields, row, i)
+
+
+def test_sample_is_reproducible_for_a_seed_and_keeps_the_previous_batch():
+    buffers = [make_buffer(max_size=9, seed=3) for _ in range(2)]
+    for buffer in buffers:
+        for i in range(12):
+            buffer.add(**make_transition(i))
+
+    first, second = (buffer.sample(8) for buffer in buffers)
+    assert torch.equal(first.states, second.states)
+
+    # sampled batches alternate between two slots, the previous batch is still intact after the next sample
+    previous_states = first.states.clone()
+    buffers[0].sample(8)
+    assert torch.equal(first.states, previous_states)
@@ -0,0 +1,213 @@
+import numpy as np
+import pytest
+
+from src.environment import FourRoomEnv, FourRoomEnvWithTagging
+from src.environment.base import Action, agents_step_kernel
+from src.environment.tagging import tally_votes_kernel
+
+
+REFERENCE_MOVES = {
+    Action.STAY: (0, 0),
+    Action.UP: (0, 1),
+    Action.DOWN: (0, -1),
+    Action.LEFT: (-1, 0),
+    Action.RIGHT: (1, 0),
+}
+
+
+def reference_agents_step(
+    env, agent_actions, agent_action_order, victim_draws, positions, alive_agents, completed_jobs,
+    used_tag_actions, tag_counts, agent_rewards,
+):
+    """
+    The per-agent step loop as the pure python env ran it (`_agent_step` / `_agent_tag`), on (x, y) positions.
+    Kill victims are the `int(draw * n)`-th crew member at the position in agent index order.
+    """
+    n_kills = n_fixes = n_sabotages = 0
+    for agent_idx in agent_action_order:
+        action = env.agent_action_map[agent_idx][agent_actions[agent_idx]]
+
+        if not isinstance(action, Action):  # tag action
+            if not used_tag_actions[agent_idx] and alive_agents[action]:
+                tag_counts[action] += 1
+                used_tag_actions[agent_idx] = True
+            continue
+
+        if not alive_agents[agent_idx]:
+            continue
+
+        pos = positions[agent_idx]
+        if action.is_move_action:
+            dx, dy = REFERENCE_MOVES[action]
+            x, y = pos[0] + dx, pos[1] + dy
+            if 0 <= x < env.n_cols and 0 <= y < env.n_rows and env.grid[y, x]:
+                positions[agent_idx] = (x, y)
+
+        elif action == Action.KILL:
+            victims = [
+                other
+                for other in range(env.n_agents)
+                if alive_agents[other] and not env.imposter_mask[other] and np.array_equal(positions[other], pos)
+            ]
+            if victims:
+                victim_idx = victims[int(victim_draws[agent_idx] * len(victims))]
+                alive_agents[victim_idx] = False
+                agent_rewards[victim_idx] = env.kill_reward
+                agent_rewards[agent_idx] = env.kill_reward
+                n_kills += 1
+
+        elif action in (Action.FIX, Action.SABOTAGE):
+            job_idxs = np.flatnonzero(np.all(env.job_positions == pos, axis=1))
+            if len(job_idxs) == 0:
+                continue
+            job_idx = job_idxs[0]
+            if action == Action.FIX and not completed_jobs[job_idx]:
+                completed_jobs[job_idx] = True
+                agent_rewards[agent_idx] = env.complete_job_reward
+                n_fixes += 1
+            elif action == Action.SABOTAGE and completed_jobs[job_idx]:
+                completed_jobs[job_idx] = False
+                agent_rewards[agent_idx] = -1 * env.sabotage_reward
+                n_sabotages += 1
+
+    return n_kills, n_fixes, n_sabotages
+
+
+def run_kernel_and_reference(env, agent_actions, agent_action_order, victim_draws, tag_counts, used_tag_actions):
+    agent_cells = env.agent_cells.copy()
+    cell_occupancy = np.zeros(env.n_rows * env.n_cols, dtype=np.int64)
+    np.bitwise_or.at(cell_occupancy, agent_cells, 1 << np.arange(env.n_agents))
+    kernel = dict(
+        agent_cells=agent_cells,
+        cell_occupancy=cell_occupancy,
+        alive_agents=env.alive_agents.copy(),
+        completed_jobs=env.completed_jobs.copy(),
+        used_tag_actions=used_tag_actions.copy(),
+        tag_counts=tag_counts.copy(),
+        agent_rewards=np.zeros(env.n_agents),
+    )
+    kernel_counts = agents_step_kernel(
+        agent_action_order,
+        env.agent_action_lut[np.arange(env.n_agents), agent_actions],
+        env._move_table,
+        kernel["agent_cells"],
+        kernel["cell_occupancy"],
+        kernel["alive_agents"],
+        env.imposter_mask,
+        env._job_at_cell,
+        kernel["completed_jobs"],
+        kernel["used_tag_actions"],
+        kernel["tag_counts"],
+        kernel["agent_rewards"],
+        victim_draws,
+        env.kill_reward,
+        env.complete_job_reward,
+        env.sabotage_reward,
+        np.empty(env.n_agents, dtype=np.int64),
+    )
+
+    reference = dict(
+        positions=env.agent_positions.astype(np.int64),
+        alive_agents=env.alive_agents.copy(),
+        completed_jobs=env.completed_jobs.copy(),
+        used_tag_actions=used_tag_actions.copy(),
+        tag_counts=tag_counts.copy(),
+        agent_rewards=np.zeros(env.n_agents),
+    )
+    reference_counts = reference_agents_step(
+        env, agent_actions, agent_action_order, victim_draws, reference["positions"], reference["alive_agents"],
+        reference["completed_jobs"], reference["used_tag_actions"], reference["tag_counts"],
+        reference["agent_rewards"],
+    )
+
+    assert tuple(kernel_counts) == reference_counts
+    assert np.array_equal(env._cell_to_xy[kernel["agent_cells"]], reference["positions"])
+    for field in ("alive_agents", "completed_jobs", "used_tag_actions", "tag_counts", "agent_rewards"):
+        assert np.array_equal(kernel[field], reference[field]), field
+
+    # the occupancy bitmasks have to stay in sync with the moved agents
+    expected_occupancy = np.zeros_like(kernel["cell_occupancy"])
+    np.bitwise_or.at(expected_occupancy, kernel["agent_cells"], 1 << np.arange(env.n_agents))
+    assert np.array_equal(kernel["cell_occupancy"], expected_occupancy)
+
+
+@pytest.mark.parametrize(
+    "make_env",
+    [
+        lambda seed: FourRoomEnv(n_imposters=1, n_crew=4, n_jobs=3, random_state=seed),
+        lambda seed: FourRoomEnvWithTagging(n_imposters=1, n_crew=4, n_jobs=3, random_state=seed),
+    ],
+    ids=["base", "tagging"],
+)
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_agents_step_kernel_matches_reference(make_env, seed):
+    env = make_env(seed)
+    rng = np.random.default_rng(seed)
+    env.reset()
+
+    tag_counts = np.zeros(env.n_agents, dtype=np.int64)
+    used_tag_actions = np.zeros(env.n_agents, dtype=bool)
+
+    for step in range(300):
+        agent_actions = env.sample_actions()
+        agent_action_order = rng.permutation(env.n_agents)
+        victim_draws = rng.random(env.n_agents)
+        if hasattr(env, "tag_counts"):
+            tag_counts, used_tag_actions = env.tag_counts, env.used_tag_actions
+        run_kernel_and_reference(env, agent_actions, agent_action_order, victim_draws, tag_counts, used_tag_actions)
+
+        # every few steps crowd everyone onto two job cells, so kills with several possible victims, fixes and
+        # sabotages get exercised
+        if step % 5 == 0:
+            crowded_cells = rng.choice(env.job_cells, size=2, replace=False)
+            saved_positions = env.agent_positions.copy()
+            env.agent_positions = env._cell_to_xy[crowded_cells[rng.integers(0, 2, env.n_agents)]]
+            imposter_action = Action.KILL if step % 10 == 0 else Action.SABOTAGE
+            crowded_actions = np.where(
+                env.imposter_mask,
+                list(env.imposter_actions).index(imposter_action),
+                list(env.crew_actions).index(Action.FIX),
+            )
+            run_kernel_and_reference(
+                env, crowded_actions, agent_action_order, victim_draws, tag_counts, used_tag_actions
+            )
+            env.agent_positions = saved_positions
+
+        _, _, done, truncated, _ = env.step(agent_actions)
+        if done or truncated:
+            env.reset()
+
+
+def reference_tally_votes(tag_counts, alive_agents, vote_now):
+    """Vote as the pure python tagging env did, after the agent steps."""
+    tag_counts *= alive_agents
+    if not vote_now:
+        return -1
+    highest_vote_idx = np.argmax(tag_counts)
+    quorum = (alive_agents.sum() + 1) // 2
+    if tag_counts[highest_vote_idx] >= quorum:
+        alive_agents[highest_vote_idx] = False
+        return highest_vote_idx
+    return -1
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_tally_votes_kernel_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(2000):
+        n_agents = int(rng.integers(2, 8))
+        tag_counts = rng.integers(0, n_agents, n_agents).astype(np.int64)
+        alive_agents = rng.random(n_agents) < 0.8
+        vote_now = bool(rng.random() < 0.5)
+        quorum = (int(alive_agents.sum()) + 1) // 2
+
+        kernel_tags, kernel_alive = tag_counts.copy(), alive_agents.copy()
+        voted_out, highest_vote = tally_votes_kernel(kernel_tags, kernel_alive, quorum, vote_now)
+
+        reference_tags, reference_alive = tag_counts.copy(), alive_agents.copy()
+        expected_voted_out = reference_tally_votes(reference_tags, reference_alive, vote_now)
+
+        assert voted_out == expected_voted_out
+        assert highest_vote == reference_tags.max()
+        assert np.array_equal(kernel_tags, reference_tags)
+        assert np.array_equal(kernel_alive, reference_alive)
@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+
+from src.environment import FourRoomEnv, FourRoomVecEnv
+from src.metrics import SusMetrics
+
+
+N_ENVS = 6
+ENV_KWARGS = dict(n_imposters=1, n_crew=3, n_jobs=2, max_time_steps=25)
+# the batched arrays that make up the state of each game
+STATE_ARRAYS = ("imposter_idxs", "imposter_mask", "agent_cells", "job_cells", "alive_agents", "completed_jobs", "t")
+
+
+class RecordingGenerator:
+    """Wraps a numpy Generator and records every `random` draw, so a single env can replay the vec env's draws."""
+
+    def __init__(self, rng):
+        self._rng = rng
+        self.random_draws = []
+
+    def random(self, *args, **kwargs):
+        draws = self._rng.random(*args, **kwargs)
+        self.random_draws.append(draws)
+        return draws
+
+    def __getattr__(self, name):
+        return getattr(self._rng, name)
+
+
+class ReplayGenerator:
+    """Stands in for a single env's generator during `step`, handing out a fixed action order and victim draws."""
+
+    def __init__(self, agent_action_order, victim_draws):
+        self.agent_action_order = agent_action_order
+        self.victim_draws = victim_draws
+
+    def shuffle(self, agent_action_order):
+        agent_action_order[:] = self.agent_action_order
+
+    def random(self, size):
+        return self.victim_draws.copy()
+
+
+def copy_into_single_env(vec_state, env_idx, single_env):
+    """Sets `single_env` (already reset once) to the state of environment `env_idx` of a `STATE_ARRAYS` snapshot."""
+    single_env.imposter_idxs = vec_state["imposter_idxs"][env_idx].copy()
+    single_env.imposter_mask = vec_state["imposter_mask"][env_idx].copy()
+    single_env.crew_mask = ~single_env.imposter_mask
+    single_env.crew_idxs = np.flatnonzero(single_env.crew_mask)
+    single_env._set_agent_cells(vec_state["agent_cells"][env_idx].copy())
+    single_env._set_job_cells(vec_state["job_cells"][env_idx].copy())
+    single_env.alive_agents = vec_state["alive_agents"][env_idx].copy()
+    single_env.completed_jobs = vec_state["completed_jobs"][env_idx].copy()
+    single_env._reset_counters()
+    single_env.agent_action_map = {
+        agent_idx: (single_env.imposter_actions if is_imposter else single_env.crew_actions).copy()
+        for agent_idx, is_imposter in enumerate(single_env.imposter_mask)
+    }
+    single_env._build_action_lut()
+    single_env.t = int(vec_state["t"][env_idx])
+    single_env.metrics.reset()
+    single_env._reset_metric_counters()
+
+
+def assert_lookups_match_state(vec_env):
+    for env_idx in range(vec_env.num_envs):
+        expected_occupancy = np.zeros_like(vec_env._cell_occupancy[env_idx])
+        np.bitwise_or.at(expected_occupancy, vec_env.agent_cells[env_idx], 1 << np.arange(vec_env.n_agents))
+        assert np.array_equal(vec_env._cell_occupancy[env_idx], expected_occupancy)
+
+        expected_job_at_cell = np.full_like(vec_env._job_at_cell[env_idx], -1)
+        expected_job_at_cell[vec_env.job_cells[env_idx]] = np.arange(vec_env.n_jobs)
+        assert np.array_equal(vec_env._job_at_cell[env_idx], expected_job_at_cell)
+
+
+def assert_fresh_episode(vec_env, obs, env_idx):
+    assert vec_env.t[env_idx] == 0
+    assert vec_env.alive_agents[env_idx].all()
+    assert not vec_env.completed_jobs[env_idx].any()
+    assert len(np.unique(vec_env.job_cells[env_idx])) == vec_env.n_jobs
+    assert vec_env.imposter_mask[env_idx].sum() == vec_env.n_imposters
+    assert all(values[env_idx] == 0 for values in vec_env.metrics.values())
+    assert np.array_equal(obs[env_idx], vec_env.single_env.flatten_state(
+        (
+            vec_env.agent_positions[env_idx],
+            vec_env.alive_agents[env_idx],
+            vec_env.job_positions[env_idx],
+            vec_env.completed_jobs[env_idx],
+        )
+    ))
+
+
+@pytest.mark.parametrize("is_action_order_random", [True, False])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_vec_env_matches_single_env(is_action_order_random, seed):
+    vec_env = FourRoomVecEnv(
+        N_ENVS, random_state=seed, is_action_order_random=is_action_order_random, **ENV_KWARGS
+    )
+    single_env = FourRoomEnv(is_action_order_random=is_action_order_random, random_state=seed, **ENV_KWARGS)
+    single_env.reset()
+
+    obs, _ = vec_env.reset()
+    assert vec_env.observation_space.contains(obs)
+    assert_lookups_match_state(vec_env)
+    recorder = vec_env._rng = RecordingGenerator(vec_env._rng)
+
+    n_finished = 0
+    for _ in range(400):
+        agent_actions = vec_env.sample_actions()
+        previous_metrics = {metric: values.copy() for metric, values in vec_env.metrics.items()}
+        previous_state = {name: getattr(vec_env, name).copy() for name in STATE_ARRAYS}
+
+        recorder.random_draws.clear()
+        obs, rewards, terminated, truncated, info = vec_env.step(agent_actions)
+
+        # the action order draws come first, then the victim draws, then any reset draws
+        order_draws = recorder.random_draws[0] if is_action_order_random else None
+        victim_draws = recorder.random_draws[1 if is_action_order_random else 0]
+
+        finished = terminated | truncated
+        if finished.any():
+            assert np.array_equal(info["_final_obs"], finished)
+            final_obs = info["final_obs"]
+        else:
+            assert "final_obs" not in info and "_final_obs" not in info
+            final_obs = obs
+
+        for env_idx in range(N_ENVS):
+            copy_into_single_env(previous_state, env_idx, single_env)
+            single_env._rng = ReplayGenerator(
+                np.argsort(order_draws[env_idx]) if is_action_order_random else np.arange(single_env.n_agents),
+                victim_draws[env_idx],
+            )
+            single_obs, single_rewards, single_done, single_truncated, single_metrics = single_env.step(
+                agent_actions[env_idx]
+            )
+
+            assert np.array_equal(final_obs[env_idx], single_obs)
+            assert np.array_equal(rewards[env_idx], single_rewards)
+            assert terminated[env_idx] == single_done
+            assert truncated[env_idx] == single_truncated
+            for metric in SusMetrics:
+                assert info[metric][env_idx] == previous_metrics[metric][env_idx] + single_metrics[metric], metric
+
+            if finished[env_idx]:
+                assert_fresh_episode(vec_env, obs, env_idx)
+            else:
+                assert vec_env.t[env_idx] == single_env.t
+
+        n_finished += finished.sum()
+        assert vec_env.observation_space.contains(obs)
+        assert_lookups_match_state(vec_env)
+
+    # the short episodes have to end often enough for the reset contract to be exercised
+    assert n_finished > N_ENVS